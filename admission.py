@@ -0,0 +1,188 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+
+# Admission control settings - can be overridden with environment variables
+RESEARCH_RATE_PER_MINUTE = float(os.getenv("RESEARCH_RATE_PER_MINUTE", "60"))  # Per user, 0 turns it off
+RESEARCH_RATE_BURST = int(os.getenv("RESEARCH_RATE_BURST", "20"))
+RESEARCH_RATE_MAX_USERS = int(os.getenv("RESEARCH_RATE_MAX_USERS", "10000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_SIZE_PER_USER = int(os.getenv("LLM_QUEUE_SIZE_PER_USER", "8"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+class TokenBucket:
+    """Refills rate tokens per second up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, cost=1):
+        """Take cost tokens and return 0, or return the seconds until they are available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+class AdmissionController:
+    """Per-user rate limits and a global cap on research requests running the agent.
+
+    Requests over the cap wait in a bounded queue. A freed slot goes to the
+    users with waiting requests in turn (round-robin), so one user with many
+    queued requests cannot starve the others. Everything runs on the event
+    loop, so no locks are needed.
+    """
+
+    def __init__(self, rate_per_minute=RESEARCH_RATE_PER_MINUTE, burst=RESEARCH_RATE_BURST,
+                 max_users=RESEARCH_RATE_MAX_USERS, max_concurrency=LLM_MAX_CONCURRENCY,
+                 queue_size=LLM_QUEUE_SIZE, queue_size_per_user=LLM_QUEUE_SIZE_PER_USER,
+                 queue_timeout=LLM_QUEUE_TIMEOUT):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_users = max_users
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_size = queue_size
+        self.queue_size_per_user = queue_size_per_user
+        self.queue_timeout = queue_timeout
+        self._buckets = OrderedDict()
+        self._active = 0
+        # user id -> waiting futures, in the order users get their next turn
+        self._waiting = OrderedDict()
+        self._queued = 0
+        # Moving average of how long a slot is held, to estimate Retry-After
+        self._hold_seconds = 1.0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.queue_full = 0
+        self.timed_out = 0
+
+    @staticmethod
+    def _reject(status_code, detail, retry_after):
+        """HTTP error telling the client when to retry"""
+        return HTTPException(
+            status_code=status_code, detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def check_rate(self, user_id, cost=1):
+        """Charge a user's token bucket, raising 429 when it is empty"""
+        if self.rate_per_minute <= 0 or cost <= 0:
+            return
+        # The bucket never holds more than burst tokens, so a bigger batch takes them all
+        cost = min(cost, self.burst)
+        bucket = self._buckets.pop(user_id, None)
+        if bucket is None:
+            bucket = TokenBucket(self.rate_per_minute / 60, self.burst)
+        # Most recently used last, so the least active user is forgotten first
+        self._buckets[user_id] = bucket
+        if len(self._buckets) > self.max_users:
+            self._buckets.popitem(last=False)
+        wait = bucket.take(cost)
+        if wait > 0:
+            self.rate_limited += 1
+            raise self._reject(429, "Too many research requests, please slow down", wait)
+
+    def check_queue(self, user_id):
+        """Raise 429 if a new request from this user would not fit in the wait queue"""
+        if self._active < self.max_concurrency and not self._queued:
+            return
+        waiting = self._waiting.get(user_id)
+        if self._queued >= self.queue_size or (waiting and len(waiting) >= self.queue_size_per_user):
+            self.queue_full += 1
+            raise self._reject(429, "Research queue is full, please retry", self._estimated_wait())
+
+    def _estimated_wait(self):
+        """Rough seconds until a newly queued request would start"""
+        return self._hold_seconds * (self._queued + 1) / self.max_concurrency
+
+    @asynccontextmanager
+    async def slot(self, user_id, bounded=True):
+        """Hold one of the max_concurrency slots for the duration of a with-block.
+
+        bounded=False is for background work: it never gets 429 and waits as long as it takes.
+        """
+        await self._acquire(user_id, bounded)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_seconds += 0.1 * (time.monotonic() - start - self._hold_seconds)
+            self._release()
+
+    async def _acquire(self, user_id, bounded):
+        """Take a free slot, or wait in the user's queue until one is handed over"""
+        if self._active < self.max_concurrency and not self._queued:
+            self._active += 1
+            self.admitted += 1
+            return
+        if bounded:
+            self.check_queue(user_id)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout if bounded else None)
+        except asyncio.TimeoutError:
+            self._forget(user_id, waiter)
+            self.timed_out += 1
+            raise self._reject(503, "Research service is busy, please retry", self._estimated_wait())
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived just as we were cancelled, pass it on
+                self._release()
+            else:
+                self._forget(user_id, waiter)
+            raise
+        self.admitted += 1
+
+    def _forget(self, user_id, waiter):
+        """Remove a waiter that gave up"""
+        waiting = self._waiting.get(user_id)
+        if waiting is None or waiter not in waiting:
+            return
+        waiting.remove(waiter)
+        self._queued -= 1
+        if not waiting:
+            del self._waiting[user_id]
+
+    def _release(self):
+        """Hand the slot to the next user in turn, or free it"""
+        while self._waiting:
+            user_id, waiting = next(iter(self._waiting.items()))
+            waiter = waiting.popleft()
+            self._queued -= 1
+            if waiting:
+                # This user goes to the back of the line
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self):
+        """Get admission statistics"""
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queued": self._queued,
+            "users_waiting": len(self._waiting),
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "queue_full": self.queue_full,
+            "timed_out": self.timed_out
+        }
+
+# Shared admission controller for the whole process
+admission = AdmissionController()
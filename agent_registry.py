@@ -0,0 +1,210 @@
+import asyncio
+import math
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from research_agent import ResearchAgent
+
+# Pool settings - can be overridden with environment variables
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "16"))
+AGENT_ACQUIRE_TIMEOUT = float(os.getenv("AGENT_ACQUIRE_TIMEOUT", "30"))
+AGENT_HEALTH_CHECK_INTERVAL = float(os.getenv("AGENT_HEALTH_CHECK_INTERVAL", "60"))
+# When the first agent (and LangChain) is loaded: "blocking" before serving, "background", or "off" (first request)
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "background")
+
+class AgentRegistry:
+    """Process-wide pool of warm ResearchAgent instances"""
+
+    def __init__(self, pool_size=AGENT_POOL_SIZE, acquire_timeout=AGENT_ACQUIRE_TIMEOUT,
+                 health_check_interval=AGENT_HEALTH_CHECK_INTERVAL):
+        self.pool_size = pool_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._created = 0
+        # While a rebuilt agent was still unhealthy, requests fail fast until then
+        self._unhealthy_until = 0.0
+        self._started = False
+
+    def startup(self):
+        """Mark the pool as started; agents are created by warm_up or on first use"""
+        with self._lock:
+            self._started = True
+        print(f"Agent registry started (pool size {self.pool_size})")
+
+    def warm_up(self):
+        """Create the first agent so the first request finds a warm client"""
+        start = time.perf_counter()
+        with self._lock:
+            needed = self._created == 0
+        if needed:
+            self._release(self._create_agent())
+            print(f"Research agent warmed up in {time.perf_counter() - start:.2f}s")
+
+    async def shutdown(self):
+        """Close every idle agent and forget about the pool"""
+        with self._lock:
+            self._started = False
+        while True:
+            try:
+                agent = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            await agent.aclose()
+        with self._lock:
+            self._created = 0
+            self._unhealthy_until = 0.0
+        print("Agent registry shut down")
+
+    def _create_agent(self):
+        """Build a new agent and count it against the pool size"""
+        with self._lock:
+            self._created += 1
+        try:
+            agent = ResearchAgent()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        return agent
+
+    def _replace(self, agent):
+        """Swap an agent that failed its health check for a new one.
+
+        Returns (replacement or None, agents to close). If the new agent is
+        unhealthy too (e.g. API keys are missing) or cannot be built, both are
+        dropped and requests fail fast for health_check_interval seconds.
+        """
+        print("Replacing unhealthy research agent")
+        with self._lock:
+            self._created -= 1
+        try:
+            replacement = self._create_agent()
+        except Exception as e:
+            print(f"Could not rebuild research agent: {e}")
+            discarded = [agent]
+        else:
+            if replacement.is_healthy():
+                return replacement, [agent]
+            with self._lock:
+                self._created -= 1
+            discarded = [agent, replacement]
+        with self._lock:
+            self._unhealthy_until = time.monotonic() + self.health_check_interval
+        return None, discarded
+
+    def _check_available(self):
+        """Raise 503 while no healthy agent can be built"""
+        with self._lock:
+            remaining = self._unhealthy_until - time.monotonic()
+        if remaining > 0:
+            raise self._unavailable(remaining)
+
+    @staticmethod
+    def _unavailable(retry_after):
+        """503 for when research agents cannot be built"""
+        return HTTPException(
+            status_code=503, detail="Research agents are unavailable, please retry",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def _take(self, timeout):
+        """Take an idle agent, growing the pool up to its size limit"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_grow = self._created < self.pool_size
+        if can_grow:
+            return self._create_agent()
+
+        try:
+            return self._pool.get(timeout=timeout)
+        except queue.Empty:
+            raise HTTPException(status_code=503, detail="All research agents are busy, please retry")
+
+    def _release(self, agent):
+        """Return an agent to the pool"""
+        try:
+            self._pool.put_nowait(agent)
+        except queue.Full:
+            with self._lock:
+                self._created -= 1
+
+    def _release_taken(self, taking):
+        """Return an agent taken for a caller that went away"""
+        if not taking.cancelled() and taking.exception() is None:
+            self._release(taking.result())
+
+    @staticmethod
+    def _close_now(agent):
+        """Close an agent from sync code, on the running event loop if there is one"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(agent.aclose())
+        else:
+            loop.create_task(agent.aclose())
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrow an agent for the duration of a with-block"""
+        self._check_available()
+        agent = self._take(self.acquire_timeout if timeout is None else timeout)
+        if not agent.is_healthy():
+            agent, discarded = self._replace(agent)
+            for old in discarded:
+                self._close_now(old)
+            if agent is None:
+                raise self._unavailable(self.health_check_interval)
+        try:
+            yield agent
+        finally:
+            self._release(agent)
+
+    @asynccontextmanager
+    async def acquire_async(self, timeout=None):
+        """Borrow an agent inside an async handler without blocking the event loop"""
+        wait_timeout = self.acquire_timeout if timeout is None else timeout
+        self._check_available()
+        try:
+            agent = self._pool.get_nowait()
+        except queue.Empty:
+            # Building a new agent (the first one imports LangChain) or waiting for a free one
+            # happens in the thread pool, never on the event loop
+            taking = asyncio.ensure_future(run_in_threadpool(self._take, wait_timeout))
+            try:
+                agent = await asyncio.shield(taking)
+            except asyncio.CancelledError:
+                # The agent still arrives; put it back in the pool instead of losing it
+                taking.add_done_callback(self._release_taken)
+                raise
+        if not agent.is_healthy():
+            agent, discarded = await run_in_threadpool(self._replace, agent)
+            for old in discarded:
+                await old.aclose()
+            if agent is None:
+                raise self._unavailable(self.health_check_interval)
+        try:
+            yield agent
+        finally:
+            self._release(agent)
+
+    def stats(self):
+        """Get pool statistics"""
+        return {
+            "pool_size": self.pool_size,
+            "created": self._created,
+            "idle": self._pool.qsize(),
+            "started": self._started
+        }
+
+# Shared registry for the whole process
+agent_registry = AgentRegistry()
@@ -0,0 +1,119 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from database import db_connection
+from cache import normalize_query
+
+# Answer cache settings - can be overridden with environment variables
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+ANSWER_CACHE_EVICT_EVERY = 100
+# Cache hits are recorded in memory and written in one UPDATE every this many hits
+ANSWER_CACHE_TOUCH_EVERY = int(os.getenv("ANSWER_CACHE_TOUCH_EVERY", "100"))
+
+class AnswerCache:
+    """LLM answers stored in SQLite, keyed on the normalized query and preferences text"""
+
+    _puts = itertools.count(1)
+    # key -> [hits, last used], not yet written to the table
+    _touches = {}
+    _touched = 0
+    _touches_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query, preferences_text):
+        """Build the cache key for a query and the preferences text sent to the LLM"""
+        raw = f"{normalize_query(query)}\n{preferences_text or ''}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get(query, preferences_text):
+        """Get a cached {"response", "sources"} entry, or None if missing or expired"""
+        key = AnswerCache.make_key(query, preferences_text)
+        now = time.time()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT response, sources FROM answer_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            )
+            row = cursor.fetchone()
+        if row:
+            # Keep the write lock off the read path, hits only touch memory
+            with AnswerCache._touches_lock:
+                touch = AnswerCache._touches.setdefault(key, [0, now])
+                touch[0] += 1
+                touch[1] = now
+                AnswerCache._touched += 1
+                due = AnswerCache._touched >= ANSWER_CACHE_TOUCH_EVERY
+            if due:
+                AnswerCache.flush_touches()
+        if not row:
+            return None
+        return {"response": row['response'], "sources": json.loads(row['sources'])}
+
+    @staticmethod
+    def flush_touches():
+        """Write the buffered hit counts and last use times in one transaction"""
+        with AnswerCache._touches_lock:
+            touches, AnswerCache._touches = AnswerCache._touches, {}
+            AnswerCache._touched = 0
+        if not touches:
+            return
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "UPDATE answer_cache SET hits = hits + ?, last_used_at = MAX(last_used_at, ?) WHERE key = ?",
+                [(hits, last_used_at, key) for key, (hits, last_used_at) in touches.items()]
+            )
+
+    @staticmethod
+    def put(query, preferences_text, response, ttl_seconds=None, sources=None):
+        """Store an answer with its sources and evict old entries now and then"""
+        key = AnswerCache.make_key(query, preferences_text)
+        now = time.time()
+        ttl = ANSWER_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """INSERT OR REPLACE INTO answer_cache
+                   (key, query, preferences, response, sources, created_at, expires_at, last_used_at, hits)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)""",
+                (key, normalize_query(query), preferences_text, response, json.dumps(sources or []), now, now + ttl, now)
+            )
+
+        # count() hands every thread its own number, no lock needed
+        if next(AnswerCache._puts) % ANSWER_CACHE_EVICT_EVERY == 0:
+            AnswerCache.evict()
+
+    @staticmethod
+    def evict(max_entries=None):
+        """Delete expired answers, then the least recently used ones over the size limit"""
+        limit = ANSWER_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        # Recent hits decide what is least recently used
+        AnswerCache.flush_touches()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM answer_cache WHERE expires_at <= ?", (time.time(),))
+            removed = cursor.rowcount
+            cursor.execute(
+                """DELETE FROM answer_cache WHERE key IN (
+                       SELECT key FROM answer_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                   )""",
+                (limit,)
+            )
+            removed += cursor.rowcount
+        return removed
+
+    @staticmethod
+    def clear():
+        """Delete every cached answer"""
+        with AnswerCache._touches_lock:
+            AnswerCache._touches = {}
+            AnswerCache._touched = 0
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM answer_cache")
@@ -1,14 +1,20 @@
+import hmac
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from user_cache import get_cached_token, cache_token, get_cached_user, cache_user
 
 # JWT settings
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # Security scheme
 security = HTTPBearer()
 
@@ -25,6 +31,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 def verify_token(token: str):
     """Verify JWT token and return user data"""
+    cached_user_id = get_cached_token(token)
+    if cached_user_id is not None:
+        return cached_user_id
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: int = payload.get("sub")
@@ -34,6 +43,7 @@ def verify_token(token: str):
                 detail="Could not validate credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        cache_token(token, user_id, payload.get("exp"))
         return user_id
     except JWTError:
         raise HTTPException(
@@ -44,10 +54,13 @@ def verify_token(token: str):
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current user from JWT token"""
-    from user_model import User
+    from user_repository import user_repository
     token = credentials.credentials
     user_id = verify_token(token)
-    user = User.get_by_id(user_id)
+    user = get_cached_user(user_id)
+    if user is None:
+        user = await user_repository.get_by_id(user_id)
+        cache_user(user)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,3 +68,19 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     return user
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow the request only if it carries the configured X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin endpoints are disabled")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+
+def get_user_id_from_header(authorization):
+    """User id from an "Authorization: Bearer" header value, or None if missing or invalid"""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return verify_token(authorization[7:].strip())
+    except HTTPException:
+        return None
@@ -0,0 +1,195 @@
+"""End-to-end benchmark of the API with fake search and LLM providers.
+
+Usage: python benchmark_app.py [--concurrency 1,8,32] [--queries-per-user 5]
+                               [--save-baseline benchmark_baseline.json | --baseline benchmark_baseline.json]
+
+Runs the FastAPI app in-process, lifespan included, against a temporary
+database. Tavily and OpenAI are replaced by fake_providers.py, so the numbers
+show this service's own overhead plus the fake latency you choose.
+
+At each concurrency level that many virtual users run the same steps at once:
+register, login, research queries, list conversations, delete conversations.
+The report gives p50/p95/p99 latency for each step and total throughput.
+
+--save-baseline writes the results to a JSON file. --baseline compares a run
+against that file and exits with status 1 when a p95 latency or the throughput
+is worse than the baseline by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+OPERATIONS = ("register", "login", "research", "list", "delete")
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+async def _virtual_user(client, level, user_index, args, latencies):
+    """Run the full scenario once for one user and record each request's latency"""
+    async def timed(operation, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        latencies[operation].append(time.perf_counter() - start)
+        response.raise_for_status()
+        return response
+
+    email = f"bench-{level}-{user_index}@example.com"
+    await timed("register", "POST", "/register/", json={
+        "email": email, "password": "bench-password", "full_name": "Bench User"
+    })
+    token = (await timed("login", "POST", "/login/", json={
+        "email": email, "password": "bench-password"
+    })).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for query_index in range(args.queries_per_user):
+        if args.query_pool:
+            # A small shared pool means users ask the same questions and hit the caches
+            query = f"benchmark question {(user_index * args.queries_per_user + query_index) % args.query_pool}"
+        else:
+            query = f"benchmark question {level}-{user_index}-{query_index}"
+        await timed("research", "GET", "/research/query", params={"query": query}, headers=headers)
+
+    await timed("list", "GET", "/conversations/", params={"limit": 50}, headers=headers)
+    await timed("delete", "DELETE", "/conversations/", headers=headers)
+
+async def _run_level(app, level, args):
+    """Run level virtual users concurrently and summarize their latencies"""
+    latencies = {operation: [] for operation in OPERATIONS}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            _virtual_user(client, level, user_index, args, latencies) for user_index in range(level)
+        ])
+        elapsed = time.perf_counter() - start
+
+    requests = sum(len(values) for values in latencies.values())
+    return {
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "throughput": round(requests / elapsed, 2),
+        "operations": {
+            operation: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2)
+            }
+            for operation, values in latencies.items()
+        }
+    }
+
+async def _run(args):
+    """Start the app with its lifespan and run every concurrency level"""
+    import main
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        for level in args.levels:
+            results[str(level)] = await _run_level(main.app, level, args)
+    return results
+
+def compare(results, baseline, tolerance, min_delta_ms=0.0):
+    """Return a list of regressions against a saved baseline"""
+    regressions = []
+    for level, base in baseline["results"].items():
+        current = results.get(level)
+        if current is None:
+            continue
+        if current["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"concurrency {level}: throughput {current['throughput']} req/s "
+                               f"vs baseline {base['throughput']} req/s")
+        for operation, base_op in base["operations"].items():
+            current_op = current["operations"].get(operation)
+            # Fast steps jitter by a few milliseconds, so small absolute changes are ignored
+            if (current_op and current_op["p95_ms"] > base_op["p95_ms"] * (1 + tolerance)
+                    and current_op["p95_ms"] - base_op["p95_ms"] > min_delta_ms):
+                regressions.append(f"concurrency {level} {operation}: p95 {current_op['p95_ms']}ms "
+                                   f"vs baseline {base_op['p95_ms']}ms")
+    return regressions
+
+def _print_report(results):
+    """Print one latency table per concurrency level"""
+    for level, result in results.items():
+        print(f"\nconcurrency {level}: {result['requests']} requests in {result['seconds']}s, "
+              f"{result['throughput']} req/s")
+        print(f"{'step':<10}{'count':>7}{'p50':>11}{'p95':>11}{'p99':>11}")
+        for operation, r in result["operations"].items():
+            print(f"{operation:<10}{r['count']:>7}{r['p50_ms']:>9.1f}ms{r['p95_ms']:>9.1f}ms{r['p99_ms']:>9.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma separated concurrency levels")
+    parser.add_argument("--queries-per-user", type=int, default=5)
+    parser.add_argument("--query-pool", type=int, default=0,
+                        help="Draw queries from this many shared questions (0: every query is new)")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Fake search latency in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake LLM latency in seconds")
+    parser.add_argument("--output-words", type=int, default=150, help="Words in each fake LLM answer")
+    parser.add_argument("--hash-rounds", type=int, default=None, help="Password hashing rounds (default: app setting)")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=25.0,
+                        help="Ignore p95 changes smaller than this many milliseconds")
+    args = parser.parse_args()
+    args.levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    # Settings are read when the modules are imported, so set them before importing the app
+    os.environ["RESEARCH_PROVIDER"] = "fake"
+    # Load LangChain before the first level so the warm-up does not show up in the timings
+    os.environ["AGENT_WARMUP"] = "blocking"
+    os.environ["FAKE_SEARCH_LATENCY"] = str(args.search_latency)
+    os.environ["FAKE_LLM_LATENCY"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_OUTPUT_WORDS"] = str(args.output_words)
+    if args.hash_rounds:
+        os.environ["PASSWORD_HASH_ROUNDS"] = str(args.hash_rounds)
+
+    import database
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE_FILE = os.path.join(tmp, "bench.db")
+        database.init_database()
+        results = asyncio.run(_run(args))
+
+    settings = {
+        "queries_per_user": args.queries_per_user,
+        "query_pool": args.query_pool,
+        "search_latency": args.search_latency,
+        "llm_latency": args.llm_latency,
+        "output_words": args.output_words,
+        "hash_rounds": args.hash_rounds
+    }
+    _print_report(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != settings:
+            print(f"\nWarning: baseline was recorded with different settings: {baseline.get('settings')}")
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
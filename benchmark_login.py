@@ -0,0 +1,95 @@
+"""Login throughput with and without the password hashing pool.
+
+Usage: python benchmark_login.py [--logins 200] [--concurrency 32] [--workers 4]
+
+Runs the FastAPI app in-process against a temporary database. It fires
+concurrent /login/ requests, first with hashing on the event loop and then
+in the pool. While the logins run, it also measures event loop lag (how late
+a 10ms timer fires). Lag is how long every other request on the worker waits.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+import database
+import password_utils
+
+async def _measure(app, logins, concurrency):
+    """Run one burst of logins and return throughput and latency figures"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        login_latencies = []
+        lags = []
+        done = asyncio.Event()
+
+        async def login():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/login/", json={"email": "bench@example.com", "password": "bench-password"})
+                login_latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        async def probe():
+            # A timer that fires late means the loop was busy hashing
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(max(0.0, time.perf_counter() - start - 0.01))
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*[login() for _ in range(logins)])
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    return {
+        "logins_per_second": logins / elapsed,
+        "login_p50_ms": statistics.median(login_latencies) * 1000,
+        "lag_p50_ms": statistics.median(lags) * 1000 if lags else 0.0,
+        "lag_max_ms": max(lags) * 1000 if lags else 0.0,
+    }
+
+async def _run(args):
+    """Register the benchmark user, then compare both hashing modes"""
+    import main
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+        await client.post("/register/", json={
+            "email": "bench@example.com", "password": "bench-password", "full_name": "Bench"
+        })
+
+    results = {}
+    for label, workers in (("event loop", 0), (f"pool ({args.workers} workers)", args.workers)):
+        password_utils.PASSWORD_HASH_WORKERS = workers
+        password_utils.shutdown_executor()
+        results[label] = await _measure(main.app, args.logins, args.concurrency)
+    password_utils.shutdown_executor()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=password_utils.PASSWORD_HASH_WORKERS or 4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE_FILE = os.path.join(tmp, "bench.db")
+        database.init_database()
+        results = asyncio.run(_run(args))
+
+    print(f"{args.logins} logins, concurrency {args.concurrency}, {password_utils.PASSWORD_HASH_ROUNDS} rounds")
+    print(f"{'mode':<22}{'logins/s':>10}{'login p50':>12}{'loop lag p50':>14}{'loop lag max':>14}")
+    for label, r in results.items():
+        print(f"{label:<22}{r['logins_per_second']:>10.1f}{r['login_p50_ms']:>10.1f}ms"
+              f"{r['lag_p50_ms']:>12.1f}ms{r['lag_max_ms']:>12.1f}ms")
+
+if __name__ == "__main__":
+    main()
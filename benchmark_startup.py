@@ -0,0 +1,118 @@
+"""Worker startup time: import cost and time to the first served requests.
+
+Usage: python benchmark_startup.py [--runs 3] [--warmup blocking,background,off]
+
+Every measurement runs in a fresh Python process with its own empty
+database, so module caches do not hide the cost a new worker pays.
+
+- import: seconds to "import main" in a fresh interpreter
+- ready: seconds from starting uvicorn until GET / answers
+- first research: latency of the first /research/query after ready,
+  which includes loading LangChain when the warm-up is off
+
+Research runs against the fake providers, so only this service's startup is measured.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _env(warmup):
+    """Environment for a child process: repo on the path, fake providers, chosen warm-up"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env["RESEARCH_PROVIDER"] = "fake"
+    env["FAKE_SEARCH_LATENCY"] = "0"
+    env["FAKE_LLM_LATENCY"] = "0"
+    env["AGENT_WARMUP"] = warmup
+    return env
+
+def measure_import(tmp):
+    """Time "import main" in a fresh interpreter"""
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=tmp, env=_env("off"),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+def _free_port():
+    """Ask the OS for an unused TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_first_requests(tmp, warmup, timeout=60):
+    """Start uvicorn and time the first GET / and the first research query"""
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:create_app", "--factory", "--port", str(port), "--log-level", "warning"],
+        cwd=tmp, env=_env(warmup), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(base_url=base_url, timeout=timeout) as client:
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError("uvicorn did not become ready in time")
+                try:
+                    if client.get("/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            ready = time.perf_counter() - start
+
+            client.post("/register/", json={"email": "startup@example.com", "password": "startup-password", "full_name": "Startup"})
+            token = client.post("/login/", json={"email": "startup@example.com", "password": "startup-password"}).json()["access_token"]
+            research_start = time.perf_counter()
+            client.get("/research/query", params={"query": "startup"}, headers={"Authorization": f"Bearer {token}"}).raise_for_status()
+            first_research = time.perf_counter() - research_start
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return ready, first_research
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per measurement (the median is reported)")
+    parser.add_argument("--warmup", default="blocking,background,off", help="AGENT_WARMUP modes to compare")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = {"import_seconds": [], "modes": {}}
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            results["import_seconds"].append(measure_import(tmp))
+    for warmup in [mode.strip() for mode in args.warmup.split(",") if mode.strip()]:
+        runs = []
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                runs.append(measure_first_requests(tmp, warmup))
+        results["modes"][warmup] = {
+            "ready_seconds": round(statistics.median(run[0] for run in runs), 3),
+            "first_research_seconds": round(statistics.median(run[1] for run in runs), 3)
+        }
+    results["import_seconds"] = round(statistics.median(results["import_seconds"]), 3)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"import main: {results['import_seconds']:.3f}s (median of {args.runs})")
+    print(f"{'warm-up':<12}{'ready':>10}{'first research':>18}")
+    for warmup, r in results["modes"].items():
+        print(f"{warmup:<12}{r['ready_seconds']:>9.3f}s{r['first_research_seconds']:>17.3f}s")
+
+if __name__ == "__main__":
+    main()
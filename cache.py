@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+", re.UNICODE)
+
+def normalize_query(query):
+    """Normalize a query so near-identical questions share a cache key.
+
+    Only case, runs of whitespace and punctuation ending the sentence are
+    ignored. Other punctuation is kept, since "C++" and "C#" are not "C".
+    """
+    text = _WHITESPACE.sub(" ", (query or "").casefold()).strip()
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry and an optional disk spill directory"""
+
+    def __init__(self, ttl_seconds=300, max_entries=1024, max_bytes=16 * 1024 * 1024,
+                 spill_dir=None, max_spill_files=10000, key_func=normalize_query):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_files = max_spill_files
+        self.key_func = key_func
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._spills_since_trim = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.spills = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _key(self, key):
+        """Apply the key normalization function"""
+        return self.key_func(key) if self.key_func else key
+
+    @staticmethod
+    def _size_of(value):
+        """Estimate how much memory a value takes, using its JSON size"""
+        try:
+            return len(json.dumps(value, default=str))
+        except (TypeError, ValueError):
+            return len(str(value))
+
+    def get(self, key, default=None):
+        """Get a cached value, or default if missing or expired"""
+        cache_key = self._key(key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                expires_at, size, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return value
+                del self._entries[cache_key]
+                self._bytes -= size
+
+        value = self._read_spill(cache_key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.disk_hits += 1
+        self._store(cache_key, value[1], value[0])
+        return value[1]
+
+    def set(self, key, value, ttl_seconds=None):
+        """Store a value for ttl_seconds (defaults to the cache TTL)"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._store(self._key(key), value, time.time() + ttl)
+
+    def delete(self, key):
+        """Remove a value from memory and disk"""
+        cache_key = self._key(key)
+        with self._lock:
+            entry = self._entries.pop(cache_key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+        if self.spill_dir:
+            try:
+                os.remove(self._spill_path(cache_key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove every in-memory entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.disk_hits = self.evictions = self.spills = 0
+
+    def _store(self, cache_key, value, expires_at):
+        """Insert an entry and evict least recently used entries over the limits"""
+        size = self._size_of(value)
+        if size > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(cache_key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[cache_key] = (expires_at, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                old_key, (old_expires, old_size, old_value) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+                evicted.append((old_key, old_expires, old_value))
+        for old_key, old_expires, old_value in evicted:
+            self._write_spill(old_key, old_expires, old_value)
+
+    def _spill_path(self, cache_key):
+        """Path of the spill file for a key"""
+        digest = hashlib.sha256(cache_key.encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, f"{digest}.json")
+
+    def _write_spill(self, cache_key, expires_at, value):
+        """Write an evicted entry to disk if spilling is enabled"""
+        if not self.spill_dir or expires_at <= time.time():
+            return
+        path = self._spill_path(cache_key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"key": cache_key, "expires_at": expires_at, "value": value}, f, default=str)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Cache spill failed: {e}")
+            return
+        with self._lock:
+            self.spills += 1
+            self._spills_since_trim += 1
+            trim = self._spills_since_trim >= max(1, self.max_spill_files // 10)
+            if trim:
+                self._spills_since_trim = 0
+        if trim:
+            self._trim_spill_dir()
+
+    def _read_spill(self, cache_key, now):
+        """Read a spilled entry, returning (expires_at, value) or None"""
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(cache_key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != cache_key:
+            return None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        if data.get("expires_at", 0) <= now:
+            return None
+        return data["expires_at"], data["value"]
+
+    def _trim_spill_dir(self):
+        """Delete expired spill files and the oldest ones over the file limit"""
+        now = time.time()
+        files = []
+        try:
+            for name in os.listdir(self.spill_dir):
+                if name.endswith(".json"):
+                    path = os.path.join(self.spill_dir, name)
+                    files.append((os.path.getmtime(path), path))
+        except OSError:
+            return
+        files.sort()
+        excess = len(files) - self.max_spill_files
+        for mtime, path in files:
+            if excess > 0:
+                excess -= 1
+            elif mtime + self.ttl_seconds > now:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """Get hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "spills": self.spills,
+                "entries": len(self._entries),
+                "bytes": self._bytes
+            }
@@ -0,0 +1,146 @@
+"""Check that several worker processes can share one database and cache file.
+
+Usage: python check_multiworker.py [--workers 4]
+
+Starts that many uvicorn processes at the same time on separate ports,
+against one fresh database and one SHARED_CACHE_FILE, like gunicorn workers
+on one host. Research runs against the fake providers. Checks:
+
+- the schema is migrated exactly once, however many workers start together
+- a user registered on one worker can log in on another
+- a conversation saved by one worker is listed by another
+- a search made by one worker is answered from the shared cache by another
+
+Exits with status 1 if any check fails.
+"""
+import argparse
+import os
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _free_port():
+    """Ask the OS for an unused TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _start_workers(tmp, count):
+    """Start count uvicorn processes sharing tmp as their working directory"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env["RESEARCH_PROVIDER"] = "fake"
+    env["FAKE_SEARCH_LATENCY"] = "0"
+    env["FAKE_LLM_LATENCY"] = "0"
+    env["AGENT_WARMUP"] = "off"
+    env["SHARED_CACHE_FILE"] = os.path.join(tmp, "shared_cache.db")
+    workers = []
+    for index in range(count):
+        port = _free_port()
+        log = open(os.path.join(tmp, f"worker-{index}.log"), "w")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:create_app", "--factory", "--port", str(port), "--log-level", "warning"],
+            cwd=tmp, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        workers.append((process, f"http://127.0.0.1:{port}", log))
+    return workers
+
+def _wait_ready(workers, timeout=60):
+    """Wait until every worker answers GET /"""
+    start = time.perf_counter()
+    for process, base_url, _ in workers:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"worker {base_url} exited with status {process.returncode}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"worker {base_url} did not become ready in time")
+            try:
+                if httpx.get(base_url + "/").status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.05)
+
+def _search_cache_hits(client):
+    """Search cache hits reported by one worker's /metrics"""
+    text = client.get("/metrics").text
+    match = re.search(r'^cache_lookups_total\{cache="search",result="hit"\} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+def run_checks(tmp, workers):
+    """Run every check and return a list of (name, passed, detail)"""
+    results = []
+    logs = ""
+    for _, _, log in workers:
+        log.flush()
+        with open(log.name) as f:
+            logs += f.read()
+    applied = re.findall(r"Applied database migration (\d+):", logs)
+    with sqlite3.connect(os.path.join(tmp, "ai_assistant.db")) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    from database import SCHEMA_VERSION
+    results.append((
+        "schema migrated once",
+        len(applied) == len(set(applied)) == SCHEMA_VERSION and version == SCHEMA_VERSION,
+        f"{len(applied)} migrations applied, schema version {version}"
+    ))
+
+    first = httpx.Client(base_url=workers[0][1], timeout=30)
+    second = httpx.Client(base_url=workers[1][1], timeout=30)
+    try:
+        user = {"email": "worker@example.com", "password": "worker-password", "full_name": "Worker"}
+        first.post("/register/", json=user).raise_for_status()
+        login = second.post("/login/", json={"email": user["email"], "password": user["password"]})
+        results.append(("login on another worker", login.status_code == 200, f"status {login.status_code}"))
+        headers = {"Authorization": f"Bearer {login.json().get('access_token')}"}
+
+        first.get("/research/query", params={"query": "shared workers"}, headers=headers).raise_for_status()
+        # Research answers are written behind, give the first worker time to flush
+        listed = []
+        deadline = time.perf_counter() + 5
+        while not listed and time.perf_counter() < deadline:
+            listed = second.get("/conversations/", headers=headers).json().get("conversations", [])
+            time.sleep(0.1)
+        results.append(("conversation visible on another worker", len(listed) == 1, f"{len(listed)} listed"))
+
+        # New preferences skip the stored answer, so the second worker has to search again
+        second.put("/preferences/", json={"summary_length": "short"}, headers=headers).raise_for_status()
+        hits_before = _search_cache_hits(second)
+        second.get("/research/query", params={"query": "shared workers"}, headers=headers).raise_for_status()
+        hits = _search_cache_hits(second) - hits_before
+        results.append(("search shared between workers", hits == 1, f"{hits:.0f} search cache hits"))
+    finally:
+        first.close()
+        second.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes to start (at least 2)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workers = _start_workers(tmp, max(2, args.workers))
+        try:
+            _wait_ready(workers)
+            results = run_checks(tmp, workers)
+        finally:
+            for process, _, log in workers:
+                process.terminate()
+                process.wait(timeout=30)
+                log.close()
+
+    for name, passed, detail in results:
+        print(f"{'ok  ' if passed else 'FAIL'} {name}: {detail}")
+    if not all(passed for _, passed, _ in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
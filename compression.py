@@ -0,0 +1,50 @@
+import hashlib
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+# Response compression settings - can be overridden with environment variables
+RESPONSE_CODEC = os.getenv("RESPONSE_CODEC", "zstd" if zstandard else "zlib")
+RESPONSE_COMPRESSION_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_LEVEL", "6"))
+RESPONSE_MIN_COMPRESS_BYTES = int(os.getenv("RESPONSE_MIN_COMPRESS_BYTES", "64"))
+
+CODEC_RAW = "raw"
+CODEC_ZLIB = "zlib"
+CODEC_ZSTD = "zstd"
+
+def hash_text(text):
+    """Content hash of a text, used as its blob key"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def compress_text(text, codec=None):
+    """Compress a text and return (codec, data); small or incompressible texts are stored raw"""
+    raw = text.encode("utf-8")
+    codec = codec or RESPONSE_CODEC
+    if len(raw) < RESPONSE_MIN_COMPRESS_BYTES:
+        return CODEC_RAW, raw
+    if codec == CODEC_ZSTD and zstandard is not None:
+        data = zstandard.ZstdCompressor(level=RESPONSE_COMPRESSION_LEVEL).compress(raw)
+    elif codec in (CODEC_ZSTD, CODEC_ZLIB):
+        codec = CODEC_ZLIB
+        data = zlib.compress(raw, RESPONSE_COMPRESSION_LEVEL)
+    else:
+        return CODEC_RAW, raw
+    if len(data) >= len(raw):
+        return CODEC_RAW, raw
+    return codec, data
+
+def decompress_text(codec, data):
+    """Turn a stored (codec, data) pair back into text"""
+    if data is None:
+        return None
+    if codec == CODEC_ZLIB:
+        data = zlib.decompress(data)
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Response was stored with zstd, install the zstandard package to read it")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return bytes(data).decode("utf-8")
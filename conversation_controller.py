@@ -1,5 +1,10 @@
 from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from conversation_model import Conversation
+from conversation_repository import conversation_repository
+from conversation_writer import conversation_writer
+from conversation_export import EXPORT_FORMATS, iter_export_chunks, export_media_type
 from user_model import User
 
 class ConversationController:
@@ -42,6 +47,7 @@ class ConversationController:
     @staticmethod
     def get_conversations_by_user(user_id):
         """Get all conversations for a specific user"""
+        conversation_writer.flush_user(user_id)
         # Check if user exists
         user = User.get_by_id(user_id)
         if not user:
@@ -50,6 +56,117 @@ class ConversationController:
         conversations = Conversation.get_by_user_id(user_id)
         return [conversation.to_dict() for conversation in conversations]
     
+    @staticmethod
+    def get_conversations_page(user_id, limit=50, after=None, include_response=True):
+        """Get one page of conversations for a user, newest first"""
+        if limit < 1 or limit > 200:
+            raise HTTPException(status_code=400, detail="Limit must be between 1 and 200")
+        
+        conversation_writer.flush_user(user_id)
+        try:
+            conversations, next_cursor = Conversation.get_page_by_user_id(user_id, limit, after, include_response)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return {
+            "conversations": [conversation.to_dict(include_response) for conversation in conversations],
+            "next_cursor": next_cursor,
+            "limit": limit
+        }
+    
+    @staticmethod
+    async def aget_conversations_page(user_id, limit=50, after=None, include_response=True):
+        """Get one page of conversations for a user without blocking the event loop"""
+        if limit < 1 or limit > 200:
+            raise HTTPException(status_code=400, detail="Limit must be between 1 and 200")
+        
+        await run_in_threadpool(conversation_writer.flush_user, user_id)
+        try:
+            conversations, next_cursor = await conversation_repository.get_page_by_user_id(
+                user_id, limit, after, include_response
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return {
+            "conversations": [conversation.to_dict(include_response) for conversation in conversations],
+            "next_cursor": next_cursor,
+            "limit": limit
+        }
+    
+    @staticmethod
+    def search_conversations(user_id, text, limit=20, offset=0):
+        """Full-text search a user's conversations"""
+        ConversationController._validate_search(text, limit, offset)
+        conversation_writer.flush_user(user_id)
+        results = Conversation.search(user_id, text, limit, offset)
+        return {
+            "query": text,
+            "results": results,
+            "limit": limit,
+            "offset": offset,
+            "next_offset": offset + limit if len(results) == limit else None
+        }
+    
+    @staticmethod
+    async def asearch_conversations(user_id, text, limit=20, offset=0):
+        """Full-text search a user's conversations without blocking the event loop"""
+        ConversationController._validate_search(text, limit, offset)
+        await run_in_threadpool(conversation_writer.flush_user, user_id)
+        results = await conversation_repository.search(user_id, text, limit, offset)
+        return {
+            "query": text,
+            "results": results,
+            "limit": limit,
+            "offset": offset,
+            "next_offset": offset + limit if len(results) == limit else None
+        }
+    
+    @staticmethod
+    def _validate_search(text, limit, offset):
+        """Check search parameters before any work is done"""
+        if not text or not text.strip():
+            raise HTTPException(status_code=400, detail="Search text cannot be empty")
+        
+        if limit < 1 or limit > 100:
+            raise HTTPException(status_code=400, detail="Limit must be between 1 and 100")
+        
+        if offset < 0:
+            raise HTTPException(status_code=400, detail="Offset cannot be negative")
+    
+    @staticmethod
+    def export_conversations(user_id, export_format="ndjson", compress=False):
+        """Stream all conversations for a user as NDJSON or CSV, optionally gzipped"""
+        ConversationController._validate_export_format(export_format)
+        conversation_writer.flush_user(user_id)
+        return ConversationController._export_response(user_id, export_format, compress)
+    
+    @staticmethod
+    async def aexport_conversations(user_id, export_format="ndjson", compress=False):
+        """Stream a user's conversations without blocking the event loop.
+        
+        The rows are read by the sync generator, which Starlette runs in the thread pool.
+        """
+        ConversationController._validate_export_format(export_format)
+        await run_in_threadpool(conversation_writer.flush_user, user_id)
+        return ConversationController._export_response(user_id, export_format, compress)
+    
+    @staticmethod
+    def _validate_export_format(export_format):
+        """Check the export format before any work is done"""
+        if export_format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(EXPORT_FORMATS)}")
+    
+    @staticmethod
+    def _export_response(user_id, export_format, compress):
+        """Build the streaming export response"""
+        filename = f"conversations-{user_id}.{export_format}" + (".gz" if compress else "")
+        return StreamingResponse(
+            iter_export_chunks(user_id, export_format, compress),
+            media_type=export_media_type(export_format, compress),
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    
     @staticmethod
     def update_conversation(conversation_id, query=None, response=None):
         """Update conversation"""
@@ -76,6 +193,7 @@ class ConversationController:
     @staticmethod
     def delete_user_conversations(user_id):
         """Delete all conversations for a specific user"""
+        conversation_writer.flush_user(user_id)
         # Check if user exists
         user = User.get_by_id(user_id)
         if not user:
@@ -84,6 +202,14 @@ class ConversationController:
         success = Conversation.delete_by_user_id(user_id)
         return {"message": f"All conversations for user {user_id} deleted successfully"}
     
+    @staticmethod
+    async def adelete_user_conversations(user_id):
+        """Delete all conversations for a user without blocking the event loop"""
+        await run_in_threadpool(conversation_writer.flush_user, user_id)
+        # The caller is the authenticated user, so there is no need to look it up again
+        await conversation_repository.delete_by_user_id(user_id)
+        return {"message": f"All conversations for user {user_id} deleted successfully"}
+    
     @staticmethod
     def get_conversations_by_email(email):
         """Get all conversations by user email"""
@@ -0,0 +1,90 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from conversation_model import Conversation
+
+EXPORT_FORMATS = ("ndjson", "csv")
+CSV_COLUMNS = ["id", "user_id", "query", "response", "timestamp"]
+
+def _encode_rows(rows, export_format, write_header):
+    """Encode a batch of rows as NDJSON lines or CSV records"""
+    if export_format == "ndjson":
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    if write_header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+def iter_export_chunks(user_id, export_format="ndjson", compress=False, batch_size=500):
+    """Yield a user's conversation history as encoded chunks, one batch of rows at a time"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Export format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    # wbits=31 writes a gzip header so the output is a regular .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    batch = []
+    first_chunk = True
+
+    def encode(rows):
+        nonlocal first_chunk
+        chunk = _encode_rows(rows, export_format, first_chunk)
+        first_chunk = False
+        return compressor.compress(chunk) if compressor else chunk
+
+    for row in Conversation.iter_rows_by_user_id(user_id, batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            chunk = encode(batch)
+            batch = []
+            if chunk:
+                yield chunk
+
+    if batch or (first_chunk and export_format == "csv"):
+        chunk = encode(batch)
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+
+def export_media_type(export_format, compress):
+    """Get the HTTP content type for an export"""
+    if compress:
+        return "application/gzip"
+    return "application/x-ndjson" if export_format == "ndjson" else "text/csv"
+
+def main(argv=None):
+    """Command line entry point: python conversation_export.py --user-id 1 --format csv --gzip -o out.csv.gz"""
+    parser = argparse.ArgumentParser(description="Export a user's conversation history")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", type=int, help="User ID to export")
+    target.add_argument("--email", help="Email of the user to export")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson", help="Output format")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows read from SQLite per batch")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    user_id = args.user_id
+    if args.email:
+        from user_model import User
+        user = User.get_by_email(args.email)
+        if not user:
+            parser.error(f"No user with email {args.email}")
+        user_id = user.id
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in iter_export_chunks(user_id, args.format, args.gzip, args.batch_size):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,127 +1,359 @@
 import sqlite3
+import base64
+import json
+import re
 from datetime import datetime
-from database import get_db_connection
+from database import db_connection, get_db_connection
+from compression import decompress_text
+from response_blob_model import ResponseBlob
+
+# Length of the query snippet returned when responses are left out
+QUERY_SNIPPET_LENGTH = 200
+
+# Markers placed around matched words in search results
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+# Columns for loading full conversations; the response stays compressed until it is read
+SELECT_COLUMNS = "c.id, c.user_id, c.query, c.timestamp, c.response_hash, b.codec, b.data"
+FROM_CONVERSATIONS = "FROM conversations c JOIN response_blobs b ON b.hash = c.response_hash"
 
 class Conversation:
-    def __init__(self, id=None, user_id=None, query=None, response=None, timestamp=None):
+    def __init__(self, id=None, user_id=None, query=None, response=None, timestamp=None,
+                 response_hash=None, compressed_response=None):
         self.id = id
         self.user_id = user_id
         self.query = query
-        self.response = response
         self.timestamp = timestamp
+        self.response_hash = response_hash
+        self._response = response
+        # (codec, data) as stored, decompressed the first time response is read
+        self._compressed_response = compressed_response
+    
+    @property
+    def response(self):
+        if self._response is None and self._compressed_response is not None:
+            self._response = decompress_text(*self._compressed_response)
+            self._compressed_response = None
+        return self._response
+    
+    @response.setter
+    def response(self, value):
+        self._response = value
+        self._compressed_response = None
+    
+    @staticmethod
+    def from_row(row):
+        """Build a conversation from a row selected with SELECT_COLUMNS"""
+        return Conversation(
+            id=row['id'],
+            user_id=row['user_id'],
+            query=row['query'],
+            timestamp=row['timestamp'],
+            response_hash=row['response_hash'],
+            compressed_response=(row['codec'], row['data'])
+        )
     
     def save(self):
         """Save conversation to database"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            return self.store(conn.cursor())
+    
+    def store(self, cursor):
+        """Insert or update the conversation with an open cursor"""
+        old_hash = self.response_hash
+        self.response_hash = ResponseBlob.store(cursor, self.response)
         
         if self.id:
             # Update existing conversation
             cursor.execute(
-                "UPDATE conversations SET user_id = ?, query = ?, response = ? WHERE id = ?",
-                (self.user_id, self.query, self.response, self.id)
+                "UPDATE conversations SET user_id = ?, query = ?, response_hash = ? WHERE id = ?",
+                (self.user_id, self.query, self.response_hash, self.id)
             )
+            if old_hash and old_hash != self.response_hash:
+                ResponseBlob.delete_orphans(cursor, [old_hash])
         else:
             # Create new conversation
             cursor.execute(
-                "INSERT INTO conversations (user_id, query, response) VALUES (?, ?, ?)",
-                (self.user_id, self.query, self.response)
+                "INSERT INTO conversations (user_id, query, response_hash) VALUES (?, ?, ?)",
+                (self.user_id, self.query, self.response_hash)
             )
             self.id = cursor.lastrowid
         
-        conn.commit()
-        conn.close()
         return self
     
+    @staticmethod
+    def save_many(conversations):
+        """Insert many new conversations in one transaction and set their ids"""
+        with db_connection() as conn:
+            return Conversation.store_many(conn.cursor(), conversations)
+    
+    @staticmethod
+    def store_many(cursor, conversations):
+        """Insert many new conversations with an open cursor and set their ids"""
+        if not conversations:
+            return conversations
+        hashes = ResponseBlob.store_many(cursor, [c.response for c in conversations])
+        for conversation, response_hash in zip(conversations, hashes):
+            conversation.response_hash = response_hash
+        cursor.executemany(
+            "INSERT INTO conversations (user_id, query, response_hash) VALUES (?, ?, ?)",
+            [(c.user_id, c.query, c.response_hash) for c in conversations]
+        )
+        # The transaction holds the write lock, so AUTOINCREMENT ids are consecutive
+        last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        first_id = last_id - len(conversations) + 1
+        for offset, conversation in enumerate(conversations):
+            conversation.id = first_id + offset
+        return conversations
+    
+    @staticmethod
+    def reserve_ids(count):
+        """Reserve a block of conversation ids and return the first one"""
+        with db_connection() as conn:
+            # Take the write lock first so two processes never get the same block
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'conversations'")
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT 'conversations', COALESCE(MAX(id), 0) FROM conversations"
+                )
+            # AUTOINCREMENT never hands out ids at or below seq, so the block is ours alone
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = seq + ? WHERE name = 'conversations' RETURNING seq",
+                (count,)
+            )
+            last_id = cursor.fetchone()[0]
+        return last_id - count + 1
+    
+    @staticmethod
+    def insert_many_with_ids(conversations):
+        """Insert conversations whose ids and timestamps were assigned in advance"""
+        if not conversations:
+            return
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            hashes = ResponseBlob.store_many(cursor, [c.response for c in conversations])
+            for conversation, response_hash in zip(conversations, hashes):
+                conversation.response_hash = response_hash
+            cursor.executemany(
+                "INSERT INTO conversations (id, user_id, query, response_hash, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(c.id, c.user_id, c.query, c.response_hash, c.timestamp) for c in conversations]
+            )
+    
     @staticmethod
     def get_all():
         """Get all conversations"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM conversations ORDER BY timestamp DESC")
-        rows = cursor.fetchall()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {SELECT_COLUMNS} {FROM_CONVERSATIONS} ORDER BY c.timestamp DESC")
+            rows = cursor.fetchall()
         
-        conversations = []
-        for row in rows:
-            conversation = Conversation(
-                id=row['id'], 
-                user_id=row['user_id'], 
-                query=row['query'], 
-                response=row['response'],
-                timestamp=row['timestamp']
-            )
-            conversations.append(conversation)
-        return conversations
+        return [Conversation.from_row(row) for row in rows]
     
     @staticmethod
     def get_by_id(conversation_id):
         """Get conversation by ID"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,))
+        with db_connection() as conn:
+            return Conversation.fetch_by_id(conn.cursor(), conversation_id)
+    
+    @staticmethod
+    def fetch_by_id(cursor, conversation_id):
+        """Get conversation by ID with an open cursor"""
+        cursor.execute(f"SELECT {SELECT_COLUMNS} {FROM_CONVERSATIONS} WHERE c.id = ?", (conversation_id,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            return Conversation(
-                id=row['id'], 
-                user_id=row['user_id'], 
-                query=row['query'], 
-                response=row['response'],
-                timestamp=row['timestamp']
-            )
+            return Conversation.from_row(row)
         return None
     
     @staticmethod
     def get_by_user_id(user_id):
         """Get all conversations for a specific user"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM conversations WHERE user_id = ? ORDER BY timestamp DESC", (user_id,))
+        with db_connection() as conn:
+            return Conversation.fetch_by_user_id(conn.cursor(), user_id)
+    
+    @staticmethod
+    def fetch_by_user_id(cursor, user_id):
+        """Get all conversations for a specific user with an open cursor"""
+        cursor.execute(
+            f"SELECT {SELECT_COLUMNS} {FROM_CONVERSATIONS} WHERE c.user_id = ? ORDER BY c.timestamp DESC, c.id DESC",
+            (user_id,)
+        )
+        return [Conversation.from_row(row) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def get_page_by_user_id(user_id, limit=50, after=None, include_response=True):
+        """Get one page of a user's conversations, newest first, and the cursor for the next page"""
+        with db_connection() as conn:
+            return Conversation.fetch_page_by_user_id(conn.cursor(), user_id, limit, after, include_response)
+    
+    @staticmethod
+    def fetch_page_by_user_id(cursor, user_id, limit=50, after=None, include_response=True):
+        """Get one page of a user's conversations with an open cursor"""
+        if include_response:
+            sql = f"SELECT {SELECT_COLUMNS} {FROM_CONVERSATIONS}"
+        else:
+            # No join, response blobs are not read at all
+            sql = (
+                f"SELECT c.id, c.user_id, substr(c.query, 1, {QUERY_SNIPPET_LENGTH}) AS query, c.timestamp, "
+                "c.response_hash, NULL AS codec, NULL AS data FROM conversations c"
+            )
+        
+        sql += " WHERE c.user_id = ?"
+        params = [user_id]
+        if after:
+            # Keyset pagination: continue strictly after the last (timestamp, id) seen
+            after_timestamp, after_id = Conversation.decode_cursor(after)
+            sql += " AND (c.timestamp, c.id) < (?, ?)"
+            params += [after_timestamp, after_id]
+        sql += " ORDER BY c.timestamp DESC, c.id DESC LIMIT ?"
+        params.append(limit + 1)
+        
+        cursor.execute(sql, params)
         rows = cursor.fetchall()
-        conn.close()
         
-        conversations = []
-        for row in rows:
-            conversation = Conversation(
-                id=row['id'], 
-                user_id=row['user_id'], 
-                query=row['query'], 
-                response=row['response'],
-                timestamp=row['timestamp']
+        conversations = [
+            Conversation.from_row(row) if include_response else Conversation(
+                id=row['id'],
+                user_id=row['user_id'],
+                query=row['query'],
+                timestamp=row['timestamp'],
+                response_hash=row['response_hash']
             )
-            conversations.append(conversation)
-        return conversations
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = conversations[-1]
+            next_cursor = Conversation.encode_cursor(last.timestamp, last.id)
+        return conversations, next_cursor
+    
+    @staticmethod
+    def build_match_expression(text):
+        """Turn free text into a safe FTS5 expression that matches all of its words"""
+        words = re.findall(r"\w+", text or "", re.UNICODE)
+        return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+    
+    @staticmethod
+    def search(user_id, text, limit=20, offset=0):
+        """Full-text search a user's conversations, best matches first"""
+        with db_connection() as conn:
+            return Conversation.fetch_search(conn.cursor(), user_id, text, limit, offset)
+    
+    @staticmethod
+    def fetch_search(cursor, user_id, text, limit=20, offset=0):
+        """Full-text search a user's conversations with an open cursor"""
+        terms = Conversation.build_match_expression(text)
+        if not terms:
+            return []
+        
+        match = f'user_id:"{int(user_id)}" AND ({terms})'
+        cursor.execute(
+            """SELECT c.id, c.user_id, c.timestamp,
+                      highlight(conversations_fts, 1, ?, ?) AS query_highlight,
+                      snippet(conversations_fts, 2, ?, ?, '...', 24) AS response_snippet,
+                      bm25(conversations_fts, 0.0, 2.0, 1.0) AS score
+               FROM conversations_fts
+               JOIN conversations c ON c.id = conversations_fts.rowid
+               WHERE conversations_fts MATCH ?
+               ORDER BY score
+               LIMIT ? OFFSET ?""",
+            (HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, match, limit, offset)
+        )
+        rows = cursor.fetchall()
+        
+        return [
+            {
+                "id": row['id'],
+                "user_id": row['user_id'],
+                "query": row['query_highlight'],
+                "snippet": row['response_snippet'],
+                "timestamp": row['timestamp'],
+                "score": round(-row['score'], 4)
+            }
+            for row in rows
+        ]
+    
+    @staticmethod
+    def iter_rows_by_user_id(user_id, batch_size=500):
+        """Yield a user's conversations oldest first as dicts, reading batch_size rows at a time"""
+        # A dedicated connection keeps a long export from holding a pooled one
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT c.id, c.user_id, c.query, b.codec, b.data, c.timestamp {FROM_CONVERSATIONS} "
+                "WHERE c.user_id = ? ORDER BY c.timestamp, c.id",
+                (user_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield {
+                        "id": row['id'],
+                        "user_id": row['user_id'],
+                        "query": row['query'],
+                        "response": decompress_text(row['codec'], row['data']),
+                        "timestamp": row['timestamp']
+                    }
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def encode_cursor(timestamp, conversation_id):
+        """Encode a (timestamp, id) position as an opaque cursor string"""
+        raw = json.dumps([timestamp, conversation_id]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decode a cursor string back into (timestamp, id), raising ValueError if invalid"""
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            timestamp, conversation_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+            return str(timestamp), int(conversation_id)
+        except Exception:
+            raise ValueError("Invalid pagination cursor")
     
     @staticmethod
     def delete_by_id(conversation_id):
         """Delete conversation by ID"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
-        return success
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM conversations WHERE id = ? RETURNING response_hash", (conversation_id,))
+            hashes = [row['response_hash'] for row in cursor.fetchall()]
+            ResponseBlob.delete_orphans(cursor, hashes)
+        return len(hashes) > 0
     
     @staticmethod
     def delete_by_user_id(user_id):
         """Delete all conversations for a specific user"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
-        return success
-    
-    def to_dict(self):
+        with db_connection() as conn:
+            return Conversation.remove_by_user_id(conn.cursor(), user_id)
+    
+    @staticmethod
+    def remove_by_user_id(cursor, user_id):
+        """Delete all conversations for a specific user with an open cursor"""
+        cursor.execute("DELETE FROM conversations WHERE user_id = ? RETURNING response_hash", (user_id,))
+        hashes = [row['response_hash'] for row in cursor.fetchall()]
+        # Blobs shared with other users' conversations are kept
+        ResponseBlob.delete_orphans(cursor, hashes)
+        return len(hashes) > 0
+    
+    def to_dict(self, include_response=True):
         """Convert conversation to dictionary"""
-        return {
+        data = {
             "id": self.id,
             "user_id": self.user_id,
             "query": self.query,
             "response": self.response,
             "timestamp": self.timestamp
         }
+        if not include_response:
+            del data["response"]
+        return data
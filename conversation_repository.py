@@ -0,0 +1,42 @@
+from db_worker import db_worker
+from conversation_model import Conversation
+
+class ConversationRepository:
+    """Async conversation storage for request handlers, run on the database thread.
+    
+    Uses the same SQL as Conversation, whose static methods stay the sync API for scripts.
+    """
+    
+    def __init__(self, worker=db_worker):
+        self.worker = worker
+    
+    async def get_by_id(self, conversation_id):
+        """Get conversation by ID"""
+        return await self.worker.run(Conversation.fetch_by_id, conversation_id)
+    
+    async def get_by_user_id(self, user_id):
+        """Get all conversations for a specific user, newest first"""
+        return await self.worker.run(Conversation.fetch_by_user_id, user_id)
+    
+    async def get_page_by_user_id(self, user_id, limit=50, after=None, include_response=True):
+        """Get one page of a user's conversations and the cursor for the next page"""
+        return await self.worker.run(Conversation.fetch_page_by_user_id, user_id, limit, after, include_response)
+    
+    async def search(self, user_id, text, limit=20, offset=0):
+        """Full-text search a user's conversations, best matches first"""
+        return await self.worker.run(Conversation.fetch_search, user_id, text, limit, offset)
+    
+    async def save(self, conversation):
+        """Insert or update a conversation"""
+        return await self.worker.run(conversation.store, write=True)
+    
+    async def save_many(self, conversations):
+        """Insert many new conversations and set their ids"""
+        return await self.worker.run(Conversation.store_many, conversations, write=True)
+    
+    async def delete_by_user_id(self, user_id):
+        """Delete all conversations for a specific user"""
+        return await self.worker.run(Conversation.remove_by_user_id, user_id, write=True)
+
+# Shared repository for the whole process
+conversation_repository = ConversationRepository()
@@ -0,0 +1,240 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from fastapi.concurrency import run_in_threadpool
+from conversation_model import Conversation
+from conversation_repository import conversation_repository
+from database import db_connection
+
+# Write-behind settings - can be overridden with environment variables
+CONVERSATION_WRITE_BEHIND = os.getenv("CONVERSATION_WRITE_BEHIND", "0") == "1"
+CONVERSATION_FLUSH_SIZE = int(os.getenv("CONVERSATION_FLUSH_SIZE", "100"))
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.5"))
+CONVERSATION_ID_BLOCK = int(os.getenv("CONVERSATION_ID_BLOCK", "100"))
+# Flushes a row may fail before it is dropped, and buffered rows before saves write through instead
+CONVERSATION_FLUSH_RETRIES = int(os.getenv("CONVERSATION_FLUSH_RETRIES", "5"))
+CONVERSATION_MAX_PENDING = int(os.getenv("CONVERSATION_MAX_PENDING", "10000"))
+# Longest wait between flushes while the database is locked or unavailable
+CONVERSATION_MAX_BACKOFF = float(os.getenv("CONVERSATION_MAX_BACKOFF", "10"))
+
+class ConversationWriteBuffer:
+    """Collects new conversations and inserts them in batched transactions"""
+
+    def __init__(self, enabled=CONVERSATION_WRITE_BEHIND, flush_size=CONVERSATION_FLUSH_SIZE,
+                 flush_interval=CONVERSATION_FLUSH_INTERVAL, id_block=CONVERSATION_ID_BLOCK,
+                 flush_retries=CONVERSATION_FLUSH_RETRIES, max_pending=CONVERSATION_MAX_PENDING,
+                 max_backoff=CONVERSATION_MAX_BACKOFF):
+        self.enabled = enabled
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.id_block = id_block
+        self.flush_retries = flush_retries
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        # Seconds the flusher waits after the database was locked, 0 when it is healthy
+        self._backoff = 0.0
+        self._pending = []
+        # conversation id -> failed flushes, for rows that were put back in the buffer
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._reserve_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._next_id = 0
+        self._last_reserved_id = -1
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+
+    def start(self):
+        """Start the background flusher"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+        print(f"Conversation write-behind enabled (batch {self.flush_size}, every {self.flush_interval}s)")
+
+    def stop(self):
+        """Stop the flusher and write everything that is still buffered"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        if self.enabled:
+            # The database may be locked for a moment, give the last rows a few tries
+            for attempt in range(self.flush_retries):
+                self.flush(durable=True)
+                if not self._backoff:
+                    break
+                time.sleep(self._backoff)
+            else:
+                print(f"Conversation writer stopped with {len(self._pending)} rows not written")
+
+    def save(self, conversation):
+        """Save a new conversation now, or buffer it when write-behind is enabled"""
+        if not self.enabled or conversation.id:
+            return conversation.save()
+        with self._lock:
+            backed_up = len(self._pending) >= self.max_pending
+        if backed_up:
+            # The buffer is not draining, so write through and let the caller see any error
+            return conversation.save()
+
+        # Give the row its final id and timestamp right away so the API can return them
+        conversation.id = self._allocate_id()
+        conversation.timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._pending.append(conversation)
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self._wakeup.set()
+        if self._thread is None:
+            # No flusher running (e.g. a script), write through
+            self.flush()
+        return conversation
+
+    def save_many(self, conversations):
+        """Save several new conversations"""
+        if not self.enabled:
+            return Conversation.save_many(conversations)
+        for conversation in conversations:
+            self.save(conversation)
+        return conversations
+
+    async def asave(self, conversation):
+        """Async save: direct writes go through the database thread"""
+        if not self.enabled or conversation.id:
+            return await conversation_repository.save(conversation)
+        # Buffering may reserve an id block or write through, so it runs in the thread pool
+        return await run_in_threadpool(self.save, conversation)
+
+    async def asave_many(self, conversations):
+        """Async save of several new conversations"""
+        if not self.enabled:
+            return await conversation_repository.save_many(conversations)
+        return await run_in_threadpool(self.save_many, conversations)
+
+    def _allocate_id(self):
+        """Hand out the next id from the reserved block, reserving a new block when empty"""
+        while True:
+            with self._lock:
+                if self._next_id <= self._last_reserved_id:
+                    conversation_id = self._next_id
+                    self._next_id += 1
+                    return conversation_id
+            # Reserve without holding _lock, so saves, flushes and stats do not wait on the database
+            with self._reserve_lock:
+                with self._lock:
+                    if self._next_id <= self._last_reserved_id:
+                        # Another thread reserved a block meanwhile
+                        continue
+                first_id = Conversation.reserve_ids(self.id_block)
+                with self._lock:
+                    self._next_id = first_id
+                    self._last_reserved_id = first_id + self.id_block - 1
+
+    def flush(self, durable=False):
+        """Insert all buffered conversations in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            written = 0
+            if batch:
+                try:
+                    Conversation.insert_many_with_ids(batch)
+                    written = len(batch)
+                    self._backoff = 0.0
+                except sqlite3.OperationalError as e:
+                    # Locked or unavailable: every row would fail the same way, keep them all
+                    self._database_failed(batch, e)
+                except Exception as e:
+                    print(f"Conversation flush failed, writing rows one at a time: {e}")
+                    written = self._insert_one_by_one(batch)
+                if written:
+                    self.flushes += 1
+                    self.rows_written += written
+            if durable and not self._backoff:
+                # synchronous=NORMAL defers fsync to checkpoints, so force one
+                with db_connection() as conn:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return written
+
+    def _database_failed(self, rows, error):
+        """Put rows back without counting a failure against them and back off"""
+        self._backoff = min(self.max_backoff, max(self.flush_interval, self._backoff * 2))
+        print(f"Conversation flush failed, retrying {len(rows)} rows in {self._backoff:g}s: {error}")
+        with self._lock:
+            self._pending = rows + self._pending
+
+    def _insert_one_by_one(self, batch):
+        """Insert rows separately so one bad row cannot hold up the others.
+
+        A row that fails on its own goes back to the buffer until it has failed
+        flush_retries flushes, then it is dropped and logged. Database errors
+        (locked, unavailable) are not the row's fault and never count.
+        """
+        written = 0
+        retry = []
+        for index, conversation in enumerate(batch):
+            try:
+                Conversation.insert_many_with_ids([conversation])
+                written += 1
+                self._failures.pop(conversation.id, None)
+                continue
+            except sqlite3.OperationalError as e:
+                self._database_failed(retry + batch[index:], e)
+                return written
+            except Exception as e:
+                error = e
+            failures = self._failures.get(conversation.id, 0) + 1
+            if failures >= self.flush_retries:
+                self._failures.pop(conversation.id, None)
+                self.rows_dropped += 1
+                print(f"Dropping conversation {conversation.id} of user {conversation.user_id} "
+                      f"after {failures} failed flushes: {error}")
+            else:
+                self._failures[conversation.id] = failures
+                retry.append(conversation)
+        if retry:
+            with self._lock:
+                self._pending = retry + self._pending
+        self._backoff = 0.0
+        return written
+
+    def flush_user(self, user_id):
+        """Flush if a user has buffered rows, so their reads see their own writes"""
+        with self._lock:
+            has_pending = any(conversation.user_id == user_id for conversation in self._pending)
+        if has_pending:
+            self.flush()
+
+    def _run(self):
+        """Flush on size or time until stopped"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self._backoff or self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        """Get buffer statistics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "enabled": self.enabled,
+            "pending": pending,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped
+        }
+
+# Shared buffer for the whole process
+conversation_writer = ConversationWriteBuffer()
+# Scripts that never run the app lifespan still get their rows written
+atexit.register(conversation_writer.stop)
@@ -1,27 +1,141 @@
 import sqlite3
 import os
+import queue
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, BEGIN IMMEDIATE still serializes migrations
+    fcntl = None
+from compression import hash_text, compress_text, decompress_text
 
 # Database file path
 DATABASE_FILE = "ai_assistant.db"
 
+# Connection pool and pragma settings - can be overridden with environment variables
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MIGRATION_LOCK_TIMEOUT = float(os.getenv("DB_MIGRATION_LOCK_TIMEOUT", "600"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    """Get a new, tuned database connection"""
+    # Prepared statements are cached per connection, keyed by the SQL text
+    conn = sqlite3.connect(DATABASE_FILE, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           cached_statements=DB_STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row  # This allows us to access columns by name
+    conn.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer
+    conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, fsync only at checkpoints
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")  # Negative value means KiB
+    # Lets SQL (the search index and its triggers) read compressed responses
+    conn.create_function("decompress_text", 2, decompress_text, deterministic=True)
     return conn
 
-def init_database():
-    """Initialize database and create tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+class ConnectionPool:
+    """Bounded pool of reusable SQLite connections"""
+    
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._database_file = DATABASE_FILE
+        self._pid = os.getpid()
+    
+    def acquire(self):
+        """Take an idle connection or open a new one"""
+        if self._pid != os.getpid():
+            # Forked worker: connections opened by the parent must not be used (or closed) here
+            self._idle = queue.LifoQueue(maxsize=self.size)
+            self._pid = os.getpid()
+        if self._database_file != DATABASE_FILE:
+            # The database file was switched (e.g. by a script), drop old connections
+            self.close_all()
+            self._database_file = DATABASE_FILE
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return get_db_connection()
     
-    # Drop existing tables to start fresh
-    cursor.execute('DROP TABLE IF EXISTS conversations')
-    cursor.execute('DROP TABLE IF EXISTS users')
+    def release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
     
-    # Create users table with email, password, full_name
-    cursor.execute('''
-        CREATE TABLE users (
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+# Shared pool for the whole process
+connection_pool = ConnectionPool()
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection, commit on success and roll back on error"""
+    conn = connection_pool.acquire()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        connection_pool.release(conn)
+
+def _move_responses_to_blobs(conn):
+    """Copy conversations into the new table, storing each distinct response once, compressed"""
+    old_seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'conversations'").fetchone()
+    read = conn.execute("SELECT id, user_id, query, response, timestamp FROM conversations ORDER BY id")
+    seen = set()
+    moved = logical_bytes = stored_bytes = 0
+    now = time.time()
+    while True:
+        rows = read.fetchmany(1000)
+        if not rows:
+            break
+        for row in rows:
+            content_hash = hash_text(row['response'])
+            size = len(row['response'].encode("utf-8"))
+            logical_bytes += size
+            if content_hash not in seen:
+                seen.add(content_hash)
+                codec, data = compress_text(row['response'])
+                stored_bytes += len(data)
+                conn.execute(
+                    "INSERT OR IGNORE INTO response_blobs (hash, codec, data, size, stored_size, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (content_hash, codec, data, size, len(data), now)
+                )
+            conn.execute(
+                "INSERT INTO conversations_new (id, user_id, query, response_hash, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (row['id'], row['user_id'], row['query'], content_hash, row['timestamp'])
+            )
+            moved += 1
+
+    # Keep the id sequence (ids may be reserved past the last row) when the table is renamed
+    if old_seq is not None:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'conversations_new'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('conversations_new', ?)", (old_seq[0],))
+    if moved:
+        print(f"Moved {moved} responses into {len(seen)} blobs: {logical_bytes} -> {stored_bytes} bytes")
+
+# Schema migrations, applied in order and recorded in PRAGMA user_version.
+# Each step is a SQL statement or a function that receives the connection.
+# Never edit a released migration, add a new one instead.
+MIGRATIONS = [
+    (1, "create users and conversations tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             email TEXT UNIQUE NOT NULL,
             password TEXT NOT NULL,
@@ -29,11 +143,9 @@ def init_database():
             preferences TEXT,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Create conversations table
-    cursor.execute('''
-        CREATE TABLE conversations (
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS conversations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
             query TEXT NOT NULL,
@@ -41,11 +153,262 @@ def init_database():
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
-    ''')
+        '''
+    ]),
+    (2, "create answer cache table", [
+        '''
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            key TEXT PRIMARY KEY,
+            query TEXT NOT NULL,
+            preferences TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_answer_cache_last_used ON answer_cache (last_used_at)"
+    ]),
+    (3, "index conversations by user and time", [
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp ON conversations (user_id, timestamp DESC)"
+    ]),
+    (4, "add id to the conversations index for keyset pagination", [
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp_id ON conversations (user_id, timestamp DESC, id DESC)",
+        "DROP INDEX IF EXISTS idx_conversations_user_timestamp"
+    ]),
+    (5, "full-text search over conversations", [
+        # External-content FTS5 index: the text lives in conversations, the index only stores tokens.
+        # user_id is indexed too so per-user searches intersect posting lists instead of filtering.
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+            user_id, query, response,
+            content='conversations', content_rowid='id',
+            tokenize='porter unicode61'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+            INSERT INTO conversations_fts(rowid, user_id, query, response)
+            VALUES (new.id, new.user_id, new.query, new.response);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+            INSERT INTO conversations_fts(conversations_fts, rowid, user_id, query, response)
+            VALUES ('delete', old.id, old.user_id, old.query, old.response);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE ON conversations BEGIN
+            INSERT INTO conversations_fts(conversations_fts, rowid, user_id, query, response)
+            VALUES ('delete', old.id, old.user_id, old.query, old.response);
+            INSERT INTO conversations_fts(rowid, user_id, query, response)
+            VALUES (new.id, new.user_id, new.query, new.response);
+        END
+        ''',
+        # Index rows written before this migration
+        "INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')"
+    ]),
+    (6, "create research jobs table", [
+        '''
+        CREATE TABLE IF NOT EXISTS research_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            query TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            conversation_id INTEGER,
+            response TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            lease_expires_at REAL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # Partial index so claiming the next job only looks at queued rows
+        "CREATE INDEX IF NOT EXISTS idx_research_jobs_queue ON research_jobs (priority DESC, id) WHERE status = 'queued'",
+        "CREATE INDEX IF NOT EXISTS idx_research_jobs_running ON research_jobs (lease_expires_at) WHERE status = 'running'",
+        "CREATE INDEX IF NOT EXISTS idx_research_jobs_user ON research_jobs (user_id, id DESC)"
+    ]),
+    (7, "store responses compressed and deduplicated in a blob table", [
+        '''
+        CREATE TABLE IF NOT EXISTS response_blobs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE conversations_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            query TEXT NOT NULL,
+            response_hash TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (response_hash) REFERENCES response_blobs (hash)
+        )
+        ''',
+        _move_responses_to_blobs,
+        "DROP TRIGGER IF EXISTS conversations_fts_insert",
+        "DROP TRIGGER IF EXISTS conversations_fts_delete",
+        "DROP TRIGGER IF EXISTS conversations_fts_update",
+        "DROP TABLE IF EXISTS conversations_fts",
+        "DROP TABLE conversations",
+        "ALTER TABLE conversations_new RENAME TO conversations",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp_id ON conversations (user_id, timestamp DESC, id DESC)",
+        # Lets deletes check quickly whether a blob is still used
+        "CREATE INDEX IF NOT EXISTS idx_conversations_response_hash ON conversations (response_hash)",
+        # The search index reads response text through this view, decompressed on demand
+        '''
+        CREATE VIEW IF NOT EXISTS conversations_content AS
+        SELECT c.id, c.user_id, c.query, decompress_text(b.codec, b.data) AS response
+        FROM conversations c JOIN response_blobs b ON b.hash = c.response_hash
+        ''',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+            user_id, query, response,
+            content='conversations_content', content_rowid='id',
+            tokenize='porter unicode61'
+        )
+        ''',
+        # Blobs are written before the conversation row and removed after it, so triggers can read them.
+        # The triggers need decompress_text, so only get_db_connection connections can write conversations
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+            INSERT INTO conversations_fts(rowid, user_id, query, response)
+            SELECT new.id, new.user_id, new.query, decompress_text(codec, data)
+            FROM response_blobs WHERE hash = new.response_hash;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+            INSERT INTO conversations_fts(conversations_fts, rowid, user_id, query, response)
+            SELECT 'delete', old.id, old.user_id, old.query, decompress_text(codec, data)
+            FROM response_blobs WHERE hash = old.response_hash;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE ON conversations BEGIN
+            INSERT INTO conversations_fts(conversations_fts, rowid, user_id, query, response)
+            SELECT 'delete', old.id, old.user_id, old.query, decompress_text(codec, data)
+            FROM response_blobs WHERE hash = old.response_hash;
+            INSERT INTO conversations_fts(rowid, user_id, query, response)
+            SELECT new.id, new.user_id, new.query, decompress_text(codec, data)
+            FROM response_blobs WHERE hash = new.response_hash;
+        END
+        ''',
+        "INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')"
+    ]),
+    (8, "store the sources of cached answers", [
+        "ALTER TABLE answer_cache ADD COLUMN sources TEXT NOT NULL DEFAULT '[]'"
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """Get the migration version recorded in the database file"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+@contextmanager
+def migration_lock():
+    """Hold an exclusive lock file next to the database while migrating.
     
+    Other workers wait here for as long as a migration takes, instead of
+    failing with "database is locked" after the busy timeout.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_file = open(f"{DATABASE_FILE}.migrate.lock", "a")
+    try:
+        deadline = time.monotonic() + DB_MIGRATION_LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Timed out waiting for another worker to finish migrating the database")
+                time.sleep(0.05)
+        yield
+    finally:
+        # Closing the file releases the lock
+        lock_file.close()
+
+def run_migrations():
+    """Apply pending schema migrations, safe to call from many workers at once"""
+    conn = get_db_connection()
+    try:
+        # Fast path: nothing to do, no lock taken
+        if get_schema_version(conn) >= SCHEMA_VERSION:
+            return 0
+    finally:
+        conn.close()
+    
+    with migration_lock():
+        return _apply_migrations()
+
+def _apply_migrations():
+    """Apply pending migrations in one transaction; called with the migration lock held"""
+    conn = get_db_connection()
+    try:
+        # BEGIN IMMEDIATE takes the write lock too, in case a process runs without the lock file
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = get_schema_version(conn)
+            applied = 0
+            for version, description, steps in MIGRATIONS:
+                if version <= current:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f"PRAGMA user_version = {version}")
+                print(f"Applied database migration {version}: {description}")
+                applied += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return applied
+    finally:
+        conn.close()
+
+def init_database():
+    """Initialize database and bring the schema up to date (keeps existing data)"""
+    applied = run_migrations()
+    if applied:
+        # Pooled connections opened before the migration may hold a stale schema
+        connection_pool.close_all()
+    print(f"Database ready (schema version {SCHEMA_VERSION})")
+
+def reset_database():
+    """Drop every table and recreate the schema - deletes all data"""
+    conn = get_db_connection()
+    conn.execute("DROP TABLE IF EXISTS research_jobs")
+    conn.execute("DROP TABLE IF EXISTS answer_cache")
+    conn.execute("DROP TABLE IF EXISTS conversations_fts")
+    conn.execute("DROP VIEW IF EXISTS conversations_content")
+    conn.execute("DROP TABLE IF EXISTS conversations")
+    conn.execute("DROP TABLE IF EXISTS response_blobs")
+    conn.execute("DROP TABLE IF EXISTS users")
+    conn.execute("PRAGMA user_version = 0")
     conn.commit()
     conn.close()
-    print("Database initialized successfully with fresh tables!")
+    connection_pool.close_all()
+    init_database()
 
 def close_db_connection(conn):
     """Close database connection"""
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from fastapi.concurrency import run_in_threadpool
+from database import db_connection, get_db_connection
+
+# Database thread settings - can be overridden with environment variables
+DB_WORKER_ENABLED = os.getenv("DB_WORKER_ENABLED", "1") == "1"
+DB_WORKER_BATCH_SIZE = int(os.getenv("DB_WORKER_BATCH_SIZE", "64"))
+
+class DatabaseWorker:
+    """One thread with one long-lived connection that runs queued database operations.
+
+    An operation is a function called as operation(cursor, *args). Operations
+    queued while the thread is busy run together in one transaction, each in
+    its own savepoint, so many small writes share a single commit and a failing
+    operation does not undo the others. The connection's statement cache keeps
+    every operation's SQL prepared between calls.
+    """
+
+    def __init__(self, enabled=DB_WORKER_ENABLED, batch_size=DB_WORKER_BATCH_SIZE):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.operations = 0
+        self.failures = 0
+        self.largest_batch = 0
+
+    def start(self):
+        """Start the database thread"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="db-worker", daemon=True)
+        self._thread.start()
+        print(f"Database thread started (batches of up to {self.batch_size} operations)")
+
+    def stop(self):
+        """Finish the queued operations and stop the thread"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        # Operations queued while the thread was stopping still run
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                operation, args, write, future = request
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(self.run_sync(operation, *args))
+                    except Exception as e:
+                        future.set_exception(e)
+
+    async def run(self, operation, *args, write=False):
+        """Run operation(cursor, *args) on the database thread and return its result.
+
+        Pass write=True for operations that change data, so their batch takes
+        the write lock up front. Without a running thread (e.g. a script) the
+        operation runs in the thread pool on a pooled connection.
+        """
+        if self._thread is None:
+            return await run_in_threadpool(self.run_sync, operation, *args)
+        future = Future()
+        self._queue.put((operation, args, write, future))
+        # Cancelling the caller cancels the operation if it has not started yet
+        return await asyncio.wrap_future(future)
+
+    @staticmethod
+    def run_sync(operation, *args):
+        """Run an operation on a pooled connection in the calling thread"""
+        with db_connection() as conn:
+            return operation(conn.cursor(), *args)
+
+    def _run(self):
+        """Take everything that is queued, up to batch_size, and run it as one batch"""
+        conn = get_db_connection()
+        # Transactions are managed explicitly
+        conn.isolation_level = None
+        try:
+            while True:
+                request = self._queue.get()
+                if request is None:
+                    break
+                batch = [request]
+                stopping = False
+                while len(batch) < self.batch_size:
+                    try:
+                        request = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is None:
+                        stopping = True
+                        break
+                    batch.append(request)
+                self._run_batch(conn, batch)
+                if stopping:
+                    break
+        finally:
+            conn.close()
+
+    def _run_batch(self, conn, batch):
+        """Run a batch in one transaction and hand out the results after it committed"""
+        # Skip operations whose callers were cancelled while they waited
+        batch = [request for request in batch if request[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            # A write batch takes the write lock first, so it waits for other writers at BEGIN
+            # instead of failing when a read turns into a write
+            conn.execute("BEGIN IMMEDIATE" if any(request[2] for request in batch) else "BEGIN")
+            try:
+                for operation, args, write, future in batch:
+                    conn.execute("SAVEPOINT operation")
+                    try:
+                        result = operation(conn.cursor(), *args)
+                        conn.execute("RELEASE operation")
+                        outcomes.append((future, result, None))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO operation")
+                        conn.execute("RELEASE operation")
+                        outcomes.append((future, None, e))
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            # BEGIN or COMMIT failed (e.g. the database stayed locked), nothing was saved
+            outcomes = [(request[3], None, e) for request in batch]
+
+        failures = 0
+        for future, result, error in outcomes:
+            if error is not None:
+                failures += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        with self._lock:
+            self.batches += 1
+            self.operations += len(batch)
+            self.failures += failures
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self):
+        """Get database thread statistics"""
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "queued": self._queue.qsize(),
+                "batches": self.batches,
+                "operations": self.operations,
+                "failures": self.failures,
+                "largest_batch": self.largest_batch
+            }
+
+# Shared database thread for the whole process
+db_worker = DatabaseWorker()
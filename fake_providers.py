@@ -0,0 +1,153 @@
+"""Deterministic local stand-ins for Tavily and OpenAI.
+
+Set RESEARCH_PROVIDER=fake to use them. Benchmarks then measure this
+service, not the network. The same input always produces the same output.
+Latency and output size come from environment variables, as does an
+optional random failure rate for trying out timeouts and circuit breakers.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Fake provider settings - can be overridden with environment variables
+FAKE_SEARCH_LATENCY = float(os.getenv("FAKE_SEARCH_LATENCY", "0.05"))
+FAKE_SEARCH_RESULTS = int(os.getenv("FAKE_SEARCH_RESULTS", "5"))
+FAKE_SEARCH_CONTENT_WORDS = int(os.getenv("FAKE_SEARCH_CONTENT_WORDS", "60"))
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.2"))
+FAKE_LLM_OUTPUT_WORDS = int(os.getenv("FAKE_LLM_OUTPUT_WORDS", "150"))
+FAKE_LLM_STREAM_CHUNK_WORDS = int(os.getenv("FAKE_LLM_STREAM_CHUNK_WORDS", "5"))
+# Fraction of calls that fail, 0 to 1
+FAKE_SEARCH_ERROR_RATE = float(os.getenv("FAKE_SEARCH_ERROR_RATE", "0"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+
+_WORDS = (
+    "research", "model", "data", "source", "analysis", "result", "system", "method",
+    "study", "evidence", "network", "signal", "theory", "process", "value", "impact"
+)
+
+def _maybe_fail(error_rate, provider):
+    """Raise for a random error_rate share of calls"""
+    if error_rate and random.random() < error_rate:
+        raise ConnectionError(f"Fake {provider} failure")
+
+def _deterministic_words(seed_text, count):
+    """Generate count words that depend only on seed_text"""
+    words = []
+    digest = hashlib.sha256(seed_text.encode("utf-8")).digest()
+    while len(words) < count:
+        for byte in digest:
+            words.append(_WORDS[byte % len(_WORDS)])
+            if len(words) == count:
+                break
+        digest = hashlib.sha256(digest).digest()
+    return words
+
+class FakeSearchTool:
+    """Search tool with the same invoke/ainvoke interface as TavilySearchResults"""
+
+    def __init__(self, latency=FAKE_SEARCH_LATENCY, max_results=FAKE_SEARCH_RESULTS,
+                 content_words=FAKE_SEARCH_CONTENT_WORDS, error_rate=FAKE_SEARCH_ERROR_RATE):
+        self.latency = latency
+        self.max_results = max_results
+        self.content_words = content_words
+        self.error_rate = error_rate
+
+    def _results(self, query):
+        """Build the result list for a query"""
+        return [
+            {
+                "title": f"Result {i} for {query}",
+                "url": f"https://example.com/{hashlib.md5(query.encode('utf-8')).hexdigest()}/{i}",
+                "content": " ".join(_deterministic_words(f"{query}:{i}", self.content_words)),
+                "score": round(1.0 - i / (self.max_results + 1), 3)
+            }
+            for i in range(1, self.max_results + 1)
+        ]
+
+    def invoke(self, tool_input):
+        """Search, blocking the calling thread for the configured latency"""
+        if self.latency:
+            time.sleep(self.latency)
+        _maybe_fail(self.error_rate, "search")
+        return self._results(tool_input["query"])
+
+    async def ainvoke(self, tool_input):
+        """Search without blocking the event loop"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        _maybe_fail(self.error_rate, "search")
+        return self._results(tool_input["query"])
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers after a fixed delay with text derived from the prompt"""
+
+    latency: float = FAKE_LLM_LATENCY
+    output_words: int = FAKE_LLM_OUTPUT_WORDS
+    stream_chunk_words: int = FAKE_LLM_STREAM_CHUNK_WORDS
+    error_rate: float = FAKE_LLM_ERROR_RATE
+
+    @property
+    def _llm_type(self):
+        return "fake-research-chat"
+
+    def _answer(self, messages):
+        """Build the answer text and token usage for a prompt"""
+        prompt = "\n".join(str(message.content) for message in messages)
+        words = _deterministic_words(prompt, self.output_words)
+        usage = {
+            "input_tokens": len(prompt.split()),
+            "output_tokens": len(words),
+            "total_tokens": len(prompt.split()) + len(words)
+        }
+        return words, usage
+
+    def _result(self, messages):
+        """Wrap the answer in a ChatResult"""
+        words, usage = self._answer(messages)
+        message = AIMessage(content=" ".join(words), usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        if self.latency:
+            time.sleep(self.latency)
+        _maybe_fail(self.error_rate, "LLM")
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        _maybe_fail(self.error_rate, "LLM")
+        return self._result(messages)
+
+    def _chunks(self, messages):
+        """Split the answer into stream chunks, usage is reported on the last one"""
+        words, usage = self._answer(messages)
+        size = max(1, self.stream_chunk_words)
+        parts = [words[i:i + size] for i in range(0, len(words), size)]
+        for index, part in enumerate(parts):
+            text = " ".join(part) + ("" if index == len(parts) - 1 else " ")
+            last = index == len(parts) - 1
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text, usage_metadata=usage if last else None))
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        _maybe_fail(self.error_rate, "LLM")
+        # The latency is spread over the chunks, like tokens arriving over time
+        chunks = list(self._chunks(messages))
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            yield chunk
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        _maybe_fail(self.error_rate, "LLM")
+        chunks = list(self._chunks(messages))
+        for chunk in chunks:
+            if self.latency:
+                await asyncio.sleep(self.latency / len(chunks))
+            yield chunk
@@ -0,0 +1,28 @@
+"""Gunicorn settings for running several Uvicorn worker processes.
+
+Usage: pip install gunicorn && gunicorn -c gunicorn.conf.py
+
+The master process migrates the database once and imports LangChain before
+forking, so workers start with the schema ready and share the imported code
+copy-on-write. Set SHARED_CACHE_FILE so workers share search results and
+users instead of each warming its own caches.
+"""
+import multiprocessing
+import os
+
+wsgi_app = "main:create_app()"
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+# Import the app in the master, before forking
+preload_app = True
+# Research answers can take a while, do not kill busy workers too early
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+
+def on_starting(server):
+    """Prepare the shared state once, before any worker is forked"""
+    from database import init_database
+    from research_agent import ResearchAgent
+    init_database()
+    ResearchAgent.preload()
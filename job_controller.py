@@ -0,0 +1,59 @@
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from job_model import ResearchJob, FINISHED_STATES
+from job_queue import research_job_queue
+
+# Longest a client may block waiting for a job result
+MAX_JOB_WAIT_SECONDS = 30
+
+class JobController:
+    
+    @staticmethod
+    async def submit_job(user_id, query, priority=0):
+        """Queue a research query and return its job id"""
+        JobController.validate_job(query, priority)
+        job = await research_job_queue.submit(user_id, query, priority)
+        return {"job_id": job.id, "status": job.status}
+    
+    @staticmethod
+    def validate_job(query, priority=0):
+        """Check a job before it is charged against the rate limit or queued"""
+        if not query or not query.strip():
+            raise HTTPException(status_code=400, detail="Query cannot be empty")
+        
+        if priority < -10 or priority > 10:
+            raise HTTPException(status_code=400, detail="Priority must be between -10 and 10")
+    
+    @staticmethod
+    async def get_job(user_id, job_id, wait=0):
+        """Get a job, optionally waiting up to wait seconds for it to finish"""
+        if wait < 0 or wait > MAX_JOB_WAIT_SECONDS:
+            raise HTTPException(status_code=400, detail=f"Wait must be between 0 and {MAX_JOB_WAIT_SECONDS} seconds")
+        
+        # Check ownership before waiting, so nobody can hold a connection open on someone else's job
+        job = await run_in_threadpool(ResearchJob.get_by_id, job_id)
+        if not job or job.user_id != user_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if wait and job.status not in FINISHED_STATES:
+            job = await research_job_queue.wait(job_id, wait) or job
+        return job.to_dict()
+    
+    @staticmethod
+    async def list_jobs(user_id, limit=50):
+        """Get a user's most recent jobs"""
+        if limit < 1 or limit > 200:
+            raise HTTPException(status_code=400, detail="Limit must be between 1 and 200")
+        
+        jobs = await run_in_threadpool(ResearchJob.get_by_user_id, user_id, limit)
+        return [job.to_dict() for job in jobs]
+    
+    @staticmethod
+    async def cancel_job(user_id, job_id):
+        """Cancel a queued or running job"""
+        cancelled = await research_job_queue.cancel(job_id, user_id)
+        if not cancelled:
+            job = await run_in_threadpool(ResearchJob.get_by_id, job_id)
+            if not job or job.user_id != user_id:
+                raise HTTPException(status_code=404, detail="Job not found")
+            raise HTTPException(status_code=409, detail=f"Job is already {job.status}")
+        return {"message": "Job cancelled successfully", "job_id": job_id}
@@ -0,0 +1,179 @@
+import time
+from database import db_connection
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+class ResearchJob:
+    def __init__(self, id=None, user_id=None, query=None, priority=0, status=JOB_QUEUED,
+                 conversation_id=None, response=None, error=None, attempts=0,
+                 created_at=None, started_at=None, finished_at=None, lease_expires_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.query = query
+        self.priority = priority
+        self.status = status
+        self.conversation_id = conversation_id
+        self.response = response
+        self.error = error
+        self.attempts = attempts
+        self.created_at = created_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.lease_expires_at = lease_expires_at
+    
+    @staticmethod
+    def _from_row(row):
+        """Build a job from a database row"""
+        return ResearchJob(**{key: row[key] for key in row.keys()})
+    
+    def save(self):
+        """Insert a new job into the queue"""
+        self.created_at = self.created_at or time.time()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO research_jobs (user_id, query, priority, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (self.user_id, self.query, self.priority, self.status, self.created_at)
+            )
+            self.id = cursor.lastrowid
+        return self
+    
+    @staticmethod
+    def get_by_id(job_id):
+        """Get job by ID"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM research_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        return ResearchJob._from_row(row) if row else None
+    
+    @staticmethod
+    def get_by_user_id(user_id, limit=50):
+        """Get a user's most recent jobs"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM research_jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, limit)
+            )
+            rows = cursor.fetchall()
+        return [ResearchJob._from_row(row) for row in rows]
+    
+    @staticmethod
+    def claim_next(lease_seconds):
+        """Atomically mark the highest-priority queued job as running and return it"""
+        now = time.time()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # A single UPDATE ... RETURNING so two workers can never claim the same job
+            cursor.execute(
+                """UPDATE research_jobs
+                   SET status = ?, started_at = ?, lease_expires_at = ?, attempts = attempts + 1
+                   WHERE id = (
+                       SELECT id FROM research_jobs WHERE status = 'queued'
+                       ORDER BY priority DESC, id LIMIT 1
+                   )
+                   RETURNING *""",
+                (JOB_RUNNING, now, now + lease_seconds)
+            )
+            row = cursor.fetchone()
+        return ResearchJob._from_row(row) if row else None
+    
+    @staticmethod
+    def finish(job_id, status, conversation_id=None, response=None, error=None):
+        """Record the outcome of a running job (ignored if it was cancelled meanwhile)"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """UPDATE research_jobs
+                   SET status = ?, conversation_id = ?, response = ?, error = ?,
+                       finished_at = ?, lease_expires_at = NULL
+                   WHERE id = ? AND status = ?""",
+                (status, conversation_id, response, error, time.time(), job_id, JOB_RUNNING)
+            )
+            success = cursor.rowcount > 0
+        return success
+    
+    @staticmethod
+    def cancel(job_id, user_id):
+        """Cancel a queued or running job that belongs to a user"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """UPDATE research_jobs SET status = ?, finished_at = ?, lease_expires_at = NULL
+                   WHERE id = ? AND user_id = ? AND status IN (?, ?)""",
+                (JOB_CANCELLED, time.time(), job_id, user_id, JOB_QUEUED, JOB_RUNNING)
+            )
+            success = cursor.rowcount > 0
+        return success
+    
+    @staticmethod
+    def extend_lease(job_id, lease_seconds):
+        """Keep a long-running job from being requeued, returns False if it was cancelled"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE research_jobs SET lease_expires_at = ? WHERE id = ? AND status = ?",
+                (time.time() + lease_seconds, job_id, JOB_RUNNING)
+            )
+            success = cursor.rowcount > 0
+        return success
+    
+    @staticmethod
+    def release(job_id):
+        """Put a running job back in the queue (used on shutdown)"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # Stopping the worker is not the job's fault, so the attempt does not count
+            cursor.execute(
+                """UPDATE research_jobs SET status = ?, lease_expires_at = NULL, attempts = MAX(attempts - 1, 0)
+                   WHERE id = ? AND status = ?""",
+                (JOB_QUEUED, job_id, JOB_RUNNING)
+            )
+    
+    @staticmethod
+    def requeue_expired(max_attempts):
+        """Put running jobs whose worker died (lease expired) back in the queue.
+
+        Jobs that already used max_attempts attempts are failed instead, so a job
+        that kills or hangs its worker every time is not retried forever.
+        Returns (requeued, failed).
+        """
+        now = time.time()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """UPDATE research_jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL
+                   WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?""",
+                (JOB_FAILED, f"Job did not finish after {max_attempts} attempts", now, now, max_attempts)
+            )
+            failed = cursor.rowcount
+            cursor.execute(
+                "UPDATE research_jobs SET status = ?, lease_expires_at = NULL WHERE status = 'running' AND lease_expires_at < ?",
+                (JOB_QUEUED, now)
+            )
+            requeued = cursor.rowcount
+        return requeued, failed
+    
+    def to_dict(self):
+        """Convert job to dictionary"""
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "query": self.query,
+            "priority": self.priority,
+            "status": self.status,
+            "conversation_id": self.conversation_id,
+            "response": self.response,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import time
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from agent_registry import agent_registry
+from admission import admission
+from research_service import ResearchService
+from job_model import ResearchJob, JOB_SUCCEEDED, JOB_FAILED, FINISHED_STATES
+
+# Job queue settings - can be overridden with environment variables
+RESEARCH_JOB_WORKERS = int(os.getenv("RESEARCH_JOB_WORKERS", "2"))
+RESEARCH_JOB_LEASE_SECONDS = float(os.getenv("RESEARCH_JOB_LEASE_SECONDS", "300"))
+RESEARCH_JOB_POLL_INTERVAL = float(os.getenv("RESEARCH_JOB_POLL_INTERVAL", "1.0"))
+# Times a job may be claimed before a worker that died or hung on it fails it for good
+RESEARCH_JOB_MAX_ATTEMPTS = int(os.getenv("RESEARCH_JOB_MAX_ATTEMPTS", "3"))
+
+class ResearchJobQueue:
+    """SQLite-backed research job queue with a bounded pool of asyncio workers"""
+
+    def __init__(self, workers=RESEARCH_JOB_WORKERS, lease_seconds=RESEARCH_JOB_LEASE_SECONDS,
+                 poll_interval=RESEARCH_JOB_POLL_INTERVAL, max_attempts=RESEARCH_JOB_MAX_ATTEMPTS):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self._wakeup = None
+        self._worker_tasks = []
+        self._running = {}
+        # job id -> events of the requests waiting for it
+        self._waiters = {}
+        self._last_requeue = 0.0
+
+    async def start(self):
+        """Recover jobs left running by a dead worker and start the workers"""
+        self._wakeup = asyncio.Event()
+        self._last_requeue = time.monotonic()
+        await self._requeue_expired()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"Research job queue started ({self.workers} workers)")
+
+    async def stop(self):
+        """Stop the workers; jobs they were running go back to the queue"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        print("Research job queue stopped")
+
+    async def submit(self, user_id, query, priority=0):
+        """Queue a research query and return the job right away"""
+        job = ResearchJob(user_id=user_id, query=query, priority=priority)
+        await run_in_threadpool(job.save)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def cancel(self, job_id, user_id):
+        """Cancel a queued or running job"""
+        cancelled = await run_in_threadpool(ResearchJob.cancel, job_id, user_id)
+        task = self._running.get(job_id)
+        if cancelled and task is not None:
+            task.cancel()
+        self._notify(job_id)
+        return cancelled
+
+    async def wait(self, job_id, timeout):
+        """Wait up to timeout seconds for a job to finish and return its latest state"""
+        deadline = time.monotonic() + timeout
+        # Local jobs wake us directly; jobs run by another process are picked up by polling
+        event = asyncio.Event()
+        self._waiters.setdefault(job_id, set()).add(event)
+        try:
+            while True:
+                job = await run_in_threadpool(ResearchJob.get_by_id, job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job.status in FINISHED_STATES or remaining <= 0:
+                    return job
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        finally:
+            waiting = self._waiters.get(job_id)
+            if waiting is not None:
+                waiting.discard(event)
+                if not waiting:
+                    del self._waiters[job_id]
+
+    def _notify(self, job_id):
+        """Wake everyone waiting on a job"""
+        for event in self._waiters.get(job_id, ()):
+            event.set()
+
+    async def _worker(self):
+        """Claim and run jobs until cancelled"""
+        while True:
+            if time.monotonic() - self._last_requeue > self.lease_seconds:
+                self._last_requeue = time.monotonic()
+                await self._requeue_expired()
+
+            job = await run_in_threadpool(ResearchJob.claim_next, self.lease_seconds)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            await self._run(job)
+
+    async def _requeue_expired(self):
+        """Requeue jobs whose worker died, failing those out of attempts"""
+        requeued, failed = await run_in_threadpool(ResearchJob.requeue_expired, self.max_attempts)
+        if requeued:
+            print(f"Requeued {requeued} interrupted research jobs")
+        if failed:
+            print(f"Failed {failed} research jobs after {self.max_attempts} attempts")
+
+    async def _run(self, job):
+        """Run one claimed job, keeping its lease alive while it runs"""
+        task = asyncio.create_task(self._execute(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, task))
+        self._running[job.id] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # The queue is stopping: hand the job back so it runs after the restart
+                await run_in_threadpool(ResearchJob.release, job.id)
+                raise
+            # Otherwise the job itself was cancelled by its user, the row already says so
+        except Exception as e:
+            print(f"Research job {job.id} crashed: {e}")
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.id, None)
+            self._notify(job.id)
+
+    async def _execute(self, job):
+        """Answer the job's query and record the outcome"""
+        try:
+            # Jobs were rate limited when submitted; here they wait for a slot as long as it takes
+            async with admission.slot(job.user_id, bounded=False), agent_registry.acquire_async() as agent:
+                result = await ResearchService(agent).aprocess_research_query(job.user_id, job.query)
+        except HTTPException as e:
+            # Includes answers the providers could not produce (503), which are not saved
+            await run_in_threadpool(ResearchJob.finish, job.id, JOB_FAILED, None, None, str(e.detail))
+            return
+
+        await run_in_threadpool(
+            ResearchJob.finish, job.id, JOB_SUCCEEDED, result["conversation_id"], result["response"], None
+        )
+
+    async def _heartbeat(self, job_id, task):
+        """Extend the lease periodically; stop the job if it was cancelled elsewhere"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            still_running = await run_in_threadpool(ResearchJob.extend_lease, job_id, self.lease_seconds)
+            if not still_running:
+                task.cancel()
+                return
+
+    def stats(self):
+        """Get worker statistics"""
+        return {
+            "workers": len(self._worker_tasks),
+            "running": len(self._running),
+            "waiters": len(self._waiters)
+        }
+
+# Shared queue for the whole process
+research_job_queue = ResearchJobQueue()
@@ -1,11 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 from database import init_database
+from agent_registry import agent_registry, AGENT_WARMUP
+from admission import admission
+from single_flight import research_flight
+from job_queue import research_job_queue
+from job_controller import JobController
+from conversation_writer import conversation_writer
+from db_worker import db_worker
+from research_agent import search_cache
+from resilience import search_guard, llm_guard
+from user_cache import token_cache, user_cache
+from metrics import registry, http_requests, http_request_duration
+from profiling import request_profiler, render_pstats_text
 from user_controller import UserController
 from conversation_controller import ConversationController
 from research_controller import ResearchController
-from auth import get_current_user
+from research_service import ResearchService
+from auth import get_current_user, require_admin, get_user_id_from_header
+from password_utils import shutdown_executor
 from user_model import User
 
 # Pydantic models for request validation
@@ -20,20 +40,138 @@ class LoginRequest(BaseModel):
     email: str
     password: str
 
+class BatchResearchRequest(BaseModel):
+    queries: List[str]
+
+class ResearchJobRequest(BaseModel):
+    query: str
+    priority: int = 0
+
 class PreferencesRequest(BaseModel):
     summary_length: Optional[str] = None
     preferred_topics: Optional[str] = None
 
-# Initialize database
-init_database()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up the database, start shared agents, workers and buffers, and drain them on shutdown"""
+    # Runs here rather than at import, so importing the app has no side effects
+    await run_in_threadpool(init_database)
+    db_worker.start()
+    agent_registry.startup()
+    conversation_writer.start()
+    await research_job_queue.start()
+    
+    # Load LangChain and build the first agent: before serving, in the background, or on first use
+    warmup = None
+    if AGENT_WARMUP == "blocking":
+        await run_in_threadpool(agent_registry.warm_up)
+    elif AGENT_WARMUP == "background":
+        warmup = asyncio.ensure_future(run_in_threadpool(agent_registry.warm_up))
+    yield
+    if warmup is not None:
+        await asyncio.gather(warmup, return_exceptions=True)
+    await research_job_queue.stop()
+    await agent_registry.shutdown()
+    conversation_writer.stop()
+    db_worker.stop()
+    shutdown_executor()
+
+router = APIRouter()
+
+async def record_request_metrics(request: Request, call_next):
+    """Record latency and status of every request, labelled by route template"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The matched route template (e.g. /research/jobs/{job_id}) keeps label cardinality bounded
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        http_request_duration.observe(time.perf_counter() - start, method=request.method, route=path)
+        http_requests.inc(method=request.method, route=path, status=status)
+
+async def profile_request(request: Request, call_next):
+    """Profile requests sent with a valid X-Profile header, or a random PROFILE_SAMPLE_RATE share"""
+    mode = request_profiler.should_profile(request.headers.get("x-profile"))
+    session = request_profiler.start(mode) if mode else None
+    if session is None:
+        return await call_next(request)
+    
+    status = 500
+    response = None
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        profile_id = request_profiler.finish(
+            session,
+            request.method,
+            route.path if route is not None else request.url.path,
+            get_user_id_from_header(request.headers.get("authorization")),
+            status
+        )
+        if response is not None:
+            response.headers["X-Profile-Id"] = profile_id
+
+def collect_runtime_metrics():
+    """Read cache, pool and queue statistics when /metrics is scraped"""
+    for name, cache in (("search", search_cache), ("user", user_cache), ("token", token_cache)):
+        stats = cache.stats()
+        yield "cache_lookups_total", "counter", "Cache lookups by result", {"cache": name, "result": "hit"}, stats["hits"]
+        yield "cache_lookups_total", "counter", "Cache lookups by result", {"cache": name, "result": "miss"}, stats["misses"]
+        yield "cache_evictions_total", "counter", "Entries evicted from a cache", {"cache": name}, stats["evictions"]
+        yield "cache_entries", "gauge", "Entries held in a cache", {"cache": name}, stats["entries"]
+    
+    admitted = admission.stats()
+    yield "admission_active", "gauge", "Research requests holding an agent slot", {}, admitted["active"]
+    yield "admission_queued", "gauge", "Research requests waiting for a slot", {}, admitted["queued"]
+    for reason in ("rate_limited", "queue_full", "timed_out"):
+        yield "admission_rejected_total", "counter", "Research requests turned away", {"reason": reason}, admitted[reason]
+    
+    for guard in (search_guard, llm_guard):
+        provider = guard.stats()
+        labels = {"provider": guard.name}
+        outcomes = {
+            "success": provider["successes"],
+            "error": provider["failures"] - provider["timeouts"],
+            "timeout": provider["timeouts"]
+        }
+        for outcome, value in outcomes.items():
+            yield "provider_calls_total", "counter", "Provider call attempts by outcome", dict(labels, outcome=outcome), value
+        yield "provider_retries_total", "counter", "Provider calls retried after a failure", labels, provider["retried"]
+        yield "provider_hedged_total", "counter", "Searches raced by a second request", labels, provider["hedged"]
+        yield "provider_circuit_open", "gauge", "1 while a provider's circuit breaker is open", labels, int(provider["circuit"]["state"] == "open")
+        yield "provider_circuit_rejected_total", "counter", "Calls refused by an open circuit breaker", labels, provider["circuit"]["rejected"]
+    
+    coalescing = research_flight.stats()
+    yield "research_coalesced_total", "counter", "Research calls that joined an identical call in flight", {}, coalescing["coalesced"]
+    yield "research_in_flight", "gauge", "Distinct research calls running", {}, coalescing["in_flight"]
+    
+    pool = agent_registry.stats()
+    yield "agent_pool_idle", "gauge", "Idle research agents", {}, pool["idle"]
+    yield "agent_pool_created", "gauge", "Research agents created", {}, pool["created"]
+    
+    yield "research_jobs_running", "gauge", "Research jobs running in this process", {}, research_job_queue.stats()["running"]
+    
+    database = db_worker.stats()
+    yield "db_worker_queued", "gauge", "Operations waiting for the database thread", {}, database["queued"]
+    yield "db_worker_batches_total", "counter", "Transactions run by the database thread", {}, database["batches"]
+    yield "db_worker_operations_total", "counter", "Operations run by the database thread", {}, database["operations"]
+    yield "db_worker_failures_total", "counter", "Database thread operations that raised an error", {}, database["failures"]
+    
+    writer = conversation_writer.stats()
+    yield "conversation_writer_pending", "gauge", "Conversations waiting to be written", {}, writer["pending"]
+    yield "conversation_writer_rows_total", "counter", "Conversations written by the write-behind buffer", {}, writer["rows_written"]
+    yield "conversation_writer_dropped_total", "counter", "Buffered conversations dropped after repeated failed flushes", {}, writer["rows_dropped"]
 
-app = FastAPI(
-    title="Personalized Research Assistant API", 
-    version="1.0.0",
-    description="AI-powered research assistant with personalized responses"
-)
+registry.add_collector(collect_runtime_metrics)
 
-@app.get("/")
+@router.get("/")
 async def root():
     return {
         "message": "Welcome to Personalized Research Assistant API",
@@ -41,16 +179,27 @@ async def root():
             "POST /register/ - Register new user with preferences (NO AUTH REQUIRED)",
             "POST /login/ - Login user (returns JWT token) (NO AUTH REQUIRED)",
             "PUT /preferences/ - Update current user preferences (AUTH REQUIRED)",
-            "GET /conversations/ - Get all conversations for current user (AUTH REQUIRED)",
+            "GET /conversations/?limit=50&after=cursor&include_response=true - Get conversations for current user, one page at a time (AUTH REQUIRED)",
+            "GET /conversations/search?q=words&limit=20&offset=0 - Full-text search your conversations (AUTH REQUIRED)",
+            "GET /conversations/export?format=ndjson|csv&gzip=false - Download full conversation history (AUTH REQUIRED)",
             "DELETE /conversations/ - Delete all conversations for current user (AUTH REQUIRED)",
-            "GET /research/query?query=your_question - Process research query with AI (AUTH REQUIRED, URL parameter)"
+            "GET /research/query?query=your_question - Process research query with AI (AUTH REQUIRED, URL parameter)",
+            "POST /research/batch - Process up to 50 research queries concurrently (AUTH REQUIRED, JSON body)",
+            "GET /research/stream?query=your_question - Stream research answer as Server-Sent Events (AUTH REQUIRED)",
+            "POST /research/jobs - Queue a research query and get a job id (AUTH REQUIRED, JSON body)",
+            "GET /research/jobs/{job_id}?wait=10 - Get job status and result, optionally waiting for it (AUTH REQUIRED)",
+            "DELETE /research/jobs/{job_id} - Cancel a queued or running job (AUTH REQUIRED)",
+            "GET /research/stats - Agent pool, search cache, coalescing and provider statistics (AUTH REQUIRED)",
+            "GET /admin/profiles - List stored request profiles (X-Admin-Token REQUIRED)",
+            "GET /admin/profiles/{profile_id}?format=raw|text - Download a request profile (X-Admin-Token REQUIRED)",
+            "GET /metrics - Request latency, research stage timings, cache and token counters in Prometheus format (NO AUTH REQUIRED)"
         ]
     }
     
 
 
 # Essential APIs only
-@app.post("/register/")
+@router.post("/register/")
 async def register_user(request: RegisterRequest):
     """Register a new user with structured preferences"""
     # Convert preferred_topics string to list if provided
@@ -58,32 +207,128 @@ async def register_user(request: RegisterRequest):
     if request.preferred_topics:
         topics_list = [topic.strip() for topic in request.preferred_topics.split(",")]
     
-    return UserController.register_user(request.email, request.password, request.full_name, request.summary_length, topics_list)
+    return await UserController.aregister_user(request.email, request.password, request.full_name, request.summary_length, topics_list)
 
-@app.post("/login/")
+@router.post("/login/")
 async def login_user(request: LoginRequest):
     """Login user"""
-    return UserController.login_user(request.email, request.password)
+    return await UserController.alogin_user(request.email, request.password)
+
+@router.get("/conversations/")
+async def get_my_conversations(
+    limit: int = 50,
+    after: Optional[str] = None,
+    include_response: bool = True,
+    current_user: User = Depends(get_current_user)
+):
+    """Get conversations for current logged-in user, newest first, one page at a time"""
+    return await ConversationController.aget_conversations_page(current_user.id, limit, after, include_response)
 
-@app.get("/conversations/")
-async def get_my_conversations(current_user: User = Depends(get_current_user)):
-    """Get all conversations for current logged-in user"""
-    return ConversationController.get_conversations_by_user(current_user.id)
+@router.get("/conversations/search")
+async def search_my_conversations(
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+    current_user: User = Depends(get_current_user)
+):
+    """Full-text search the current user's conversations, best matches first"""
+    return await ConversationController.asearch_conversations(current_user.id, q, limit, offset)
 
-@app.delete("/conversations/")
+@router.get("/conversations/export")
+async def export_my_conversations(
+    format: str = "ndjson",
+    gzip: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Stream the full conversation history of the current user as NDJSON or CSV"""
+    return await ConversationController.aexport_conversations(current_user.id, format, gzip)
+
+@router.delete("/conversations/")
 async def delete_my_conversations(current_user: User = Depends(get_current_user)):
     """Delete all conversations for current logged-in user"""
-    return ConversationController.delete_user_conversations(current_user.id)
+    return await ConversationController.adelete_user_conversations(current_user.id)
 
 
-@app.get("/research/query")
+@router.get("/research/query")
 async def research_query_get(query: str, current_user: User = Depends(get_current_user)):
     """Process a research query with AI assistance (URL parameter)"""
-    research_controller = ResearchController()
-    return research_controller.process_query(current_user.id, query)
+    ResearchController.validate_query(current_user.id, query)
+    admission.check_rate(current_user.id)
+    async with admission.slot(current_user.id), agent_registry.acquire_async() as agent:
+        research_controller = ResearchController(agent)
+        return await research_controller.aprocess_query(current_user.id, query, current_user)
 
+@router.post("/research/batch")
+async def research_batch(request: BatchResearchRequest, current_user: User = Depends(get_current_user)):
+    """Process many research queries concurrently and return every result in one response"""
+    # Each valid query counts against the rate limit and takes its own slot while it runs
+    cost = ResearchController.validate_batch(current_user.id, request.queries)
+    admission.check_rate(current_user.id, cost=cost)
+    async with agent_registry.acquire_async() as agent:
+        research_controller = ResearchController(agent)
+        return await research_controller.abatch_process_queries(current_user.id, request.queries, current_user)
 
-@app.put("/preferences/")
+@router.get("/research/stream")
+async def research_stream(query: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Stream a research answer as Server-Sent Events (sources, token..., done)"""
+    ResearchController.validate_query(current_user.id, query)
+    # Reject before the response starts; once streaming, errors can only be sent as events
+    admission.check_rate(current_user.id)
+    admission.check_queue(current_user.id)
+    
+    async def event_stream():
+        try:
+            async with admission.slot(current_user.id), agent_registry.acquire_async() as agent:
+                research_controller = ResearchController(agent)
+                async for event in research_controller.astream_query(current_user.id, query, request.is_disconnected, current_user):
+                    yield event
+        except HTTPException as e:
+            yield ResearchService.sse_event("error", {"detail": e.detail, "retry_after": e.headers.get("Retry-After")})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/research/jobs")
+async def submit_research_job(request: ResearchJobRequest, current_user: User = Depends(get_current_user)):
+    """Queue a research query and return a job id right away"""
+    JobController.validate_job(request.query, request.priority)
+    admission.check_rate(current_user.id)
+    return await JobController.submit_job(current_user.id, request.query, request.priority)
+
+@router.get("/research/jobs")
+async def list_research_jobs(limit: int = 50, current_user: User = Depends(get_current_user)):
+    """Get the current user's most recent research jobs"""
+    return await JobController.list_jobs(current_user.id, limit)
+
+@router.get("/research/jobs/{job_id}")
+async def get_research_job(job_id: int, wait: float = 0, current_user: User = Depends(get_current_user)):
+    """Get a research job; wait=N blocks up to N seconds until it finishes"""
+    return await JobController.get_job(current_user.id, job_id, wait)
+
+@router.delete("/research/jobs/{job_id}")
+async def cancel_research_job(job_id: int, current_user: User = Depends(get_current_user)):
+    """Cancel a queued or running research job"""
+    return await JobController.cancel_job(current_user.id, job_id)
+
+@router.get("/research/stats")
+async def research_stats(current_user: User = Depends(get_current_user)):
+    """Get agent pool, search cache, request coalescing and provider statistics"""
+    return {
+        "agent_pool": agent_registry.stats(),
+        "admission": admission.stats(),
+        "job_queue": research_job_queue.stats(),
+        "conversation_writer": conversation_writer.stats(),
+        "db_worker": db_worker.stats(),
+        "search_cache": search_cache.stats(),
+        "coalescing": research_flight.stats(),
+        "providers": {"search": search_guard.stats(), "llm": llm_guard.stats()}
+    }
+
+
+@router.put("/preferences/")
 async def update_preferences(request: PreferencesRequest, current_user: User = Depends(get_current_user)):
     """Update current user preferences"""
     # Convert preferred_topics string to list if provided
@@ -91,9 +336,52 @@ async def update_preferences(request: PreferencesRequest, current_user: User = D
     if request.preferred_topics:
         topics_list = [topic.strip() for topic in request.preferred_topics.split(",")]
     
-    return UserController.update_user_preferences(current_user.id, request.summary_length, topics_list)
+    return await UserController.aupdate_user_preferences(current_user.id, request.summary_length, topics_list)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List stored request profiles, newest first"""
+    return {
+        "profiles": await run_in_threadpool(request_profiler.store.list),
+        "skipped_while_busy": request_profiler.skipped
+    }
+
+@router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, format: str = "raw"):
+    """Download a profile: collapsed stacks or a pstats file, or format=text for a pstats summary"""
+    found = request_profiler.store.get(profile_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    meta, path = found
+    if format == "text" and meta["mode"] == "cprofile":
+        return PlainTextResponse(await run_in_threadpool(render_pstats_text, path))
+    if format not in ("raw", "text"):
+        raise HTTPException(status_code=400, detail="Format must be raw or text")
+    media_type = "text/plain" if meta["mode"] == "sample" else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+def create_app():
+    """Build the FastAPI application; cheap, nothing heavy is loaded until startup or first use"""
+    app = FastAPI(
+        title="Personalized Research Assistant API", 
+        version="1.0.0",
+        description="AI-powered research assistant with personalized responses",
+        lifespan=lifespan
+    )
+    app.middleware("http")(record_request_metrics)
+    app.middleware("http")(profile_request)
+    app.include_router(router)
+    return app
+
+# For "uvicorn main:app"; "uvicorn main:create_app --factory" works too
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True)
-    print("Server is running on http://127.0.0.1:8000")
\ No newline at end of file
+    # reload needs the app as an import string; it runs the module-level app above
+    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -1,8 +1,32 @@
 from passlib.context import CryptContext
+import asyncio
 import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-# Password hashing - using pbkdf2_sha256 which has no length limit
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# Hashing cost and worker pool settings - can be overridden with environment variables
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))  # 0 hashes on the event loop
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")  # "thread" or "process"
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+
+# Password hashing - using pbkdf2_sha256 which has no length limit.
+# min/max rounds equal to the default so hashes made with another cost need an update.
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__min_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__max_rounds=PASSWORD_HASH_ROUNDS
+)
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashing jobs are already waiting"""
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
 
 def verify_password(plain_password, hashed_password):
     """Verify a password against its hash"""
@@ -11,3 +35,51 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     """Hash a password"""
     return pwd_context.hash(password)
+
+def verify_and_update(plain_password, hashed_password):
+    """Verify a password and return (valid, new_hash); new_hash is set when the cost changed"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+def _get_executor():
+    """Create the hashing pool on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if PASSWORD_HASH_EXECUTOR == "process":
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+        return _executor
+
+def shutdown_executor():
+    """Stop the hashing pool"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+async def _run_in_pool(fn, *args):
+    """Run a hashing function in the worker pool, refusing work when the queue is full"""
+    global _pending
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+
+    with _executor_lock:
+        if _pending >= PASSWORD_HASH_QUEUE_LIMIT:
+            raise PasswordHasherBusy("Too many password hashing requests, please retry")
+        _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        with _executor_lock:
+            _pending -= 1
+
+async def averify_and_update(plain_password, hashed_password):
+    """Async version of verify_and_update that runs in the hashing pool"""
+    return await _run_in_pool(verify_and_update, plain_password, hashed_password)
+
+async def aget_password_hash(password):
+    """Async version of get_password_hash that runs in the hashing pool"""
+    return await _run_in_pool(get_password_hash, password)
@@ -0,0 +1,207 @@
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Profiling settings - can be overridden with environment variables
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")  # Requests with "X-Profile: <token>" are profiled
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # Fraction of all requests profiled
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")  # "sample" (collapsed stacks) or "cprofile" (pstats)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "research_profiles"))
+PROFILE_MAX_ENTRIES = int(os.getenv("PROFILE_MAX_ENTRIES", "50"))
+
+PROFILE_MODES = ("sample", "cprofile")
+PROFILE_EXTENSIONS = {"sample": ".collapsed", "cprofile": ".pstats"}
+
+# Samples whose innermost frame is in one of these files are threads waiting for work
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py", "thread.py")
+
+class StackSampler:
+    """Samples the stacks of every thread at a fixed interval and counts them as collapsed stacks"""
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a background thread"""
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread"""
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        """Take one sample of every busy thread per interval"""
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def dump(self, path):
+        """Write the stacks in the collapsed format read by flamegraph.pl and speedscope"""
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+class ProfileStore:
+    """Profiles on local disk, keeping only the newest max_entries"""
+
+    def __init__(self, directory=PROFILE_DIR, max_entries=PROFILE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _meta_path(self, profile_id):
+        """Path of a profile's metadata file"""
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def new_path(self, profile_id, mode):
+        """Path where a new profile's data goes"""
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, profile_id + PROFILE_EXTENSIONS[mode])
+
+    def add(self, meta):
+        """Record a finished profile and drop the oldest ones over the limit"""
+        with self._lock:
+            with open(self._meta_path(meta["id"]), "w") as f:
+                json.dump(meta, f)
+            for old in self.list()[self.max_entries:]:
+                self.delete(old["id"])
+
+    def list(self):
+        """Metadata of every stored profile, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        profiles.sort(key=lambda meta: meta["started_at"], reverse=True)
+        return profiles
+
+    def get(self, profile_id):
+        """Metadata and data path of one profile, or None"""
+        # Ids are generated by us, anything else (e.g. a path) is not a profile
+        try:
+            if str(uuid.UUID(profile_id)) != profile_id:
+                return None
+        except ValueError:
+            return None
+        try:
+            with open(self._meta_path(profile_id)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = os.path.join(self.directory, profile_id + PROFILE_EXTENSIONS[meta["mode"]])
+        return (meta, path) if os.path.exists(path) else None
+
+    def delete(self, profile_id):
+        """Remove a profile and its data"""
+        for extension in (".json",) + tuple(PROFILE_EXTENSIONS.values()):
+            try:
+                os.remove(os.path.join(self.directory, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+class RequestProfiler:
+    """Decides which requests to profile and runs one profile at a time"""
+
+    def __init__(self, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE, mode=PROFILE_MODE,
+                 store=None):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.mode = mode if mode in PROFILE_MODES else "sample"
+        self.store = store or ProfileStore()
+        # Profilers see every request running at the same time, so only one runs at once
+        self._active = threading.Lock()
+        self.skipped = 0
+
+    def should_profile(self, header_value):
+        """Return the mode to profile a request with, or None"""
+        if header_value and self.token:
+            requested, _, mode = header_value.partition(":")
+            if hmac.compare_digest(requested.encode("utf-8"), self.token.encode("utf-8")):
+                return mode if mode in PROFILE_MODES else self.mode
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return self.mode
+        return None
+
+    def start(self, mode):
+        """Start profiling, or return None if another profile is running"""
+        if not self._active.acquire(blocking=False):
+            self.skipped += 1
+            return None
+        if mode == "cprofile":
+            # cProfile only sees the event loop thread, not the thread pool
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler()
+            profiler.start()
+        return {"id": str(uuid.uuid4()), "mode": mode, "profiler": profiler,
+                "started_at": time.time(), "start": time.perf_counter()}
+
+    def finish(self, session, method, route, user_id, status):
+        """Stop profiling, save the result and return the profile id"""
+        try:
+            profiler = session["profiler"]
+            duration = time.perf_counter() - session["start"]
+            if session["mode"] == "cprofile":
+                profiler.disable()
+                profiler.dump_stats(self.store.new_path(session["id"], "cprofile"))
+            else:
+                profiler.stop()
+                profiler.dump(self.store.new_path(session["id"], "sample"))
+            self.store.add({
+                "id": session["id"],
+                "mode": session["mode"],
+                "method": method,
+                "route": route,
+                "user_id": int(user_id) if user_id is not None else None,
+                "status": status,
+                "started_at": session["started_at"],
+                "duration_ms": round(duration * 1000, 2)
+            })
+            return session["id"]
+        finally:
+            self._active.release()
+
+def render_pstats_text(path, limit=60):
+    """Readable summary of a pstats file, slowest cumulative time first"""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+# Shared profiler for the whole process
+request_profiler = RequestProfiler()
@@ -1,113 +1,408 @@
 import os
-from langchain_openai import ChatOpenAI
-from langchain_community.tools import TavilySearchResults
-from langchain_core.prompts import ChatPromptTemplate
+import time
+from cache import TTLCache
+from shared_cache import with_shared_tier
+from metrics import span, record_token_usage, research_stage_duration, research_stage_errors, research_degraded
+from resilience import search_guard, llm_guard, CircuitOpenError, LLM_TIMEOUT_SECONDS
+
+# Search result cache settings - can be overridden with environment variables
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2048"))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+SEARCH_CACHE_SPILL_DIR = os.getenv("SEARCH_CACHE_SPILL_DIR")
+# How long old search results may stand in for a failed search, 0 turns it off
+SEARCH_STALE_TTL_SECONDS = int(os.getenv("SEARCH_STALE_TTL_SECONDS", "86400"))
+
+# "openai" uses OpenAI and Tavily, "fake" uses the local stand-ins in fake_providers.py
+RESEARCH_PROVIDER = os.getenv("RESEARCH_PROVIDER", "openai")
+
+# Shared by every agent in the process so pooled agents see the same results,
+# and by every worker process when SHARED_CACHE_FILE is set
+search_cache = with_shared_tier(TTLCache(
+    ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    max_bytes=SEARCH_CACHE_MAX_BYTES,
+    spill_dir=SEARCH_CACHE_SPILL_DIR
+), "search")
+
+# Results kept after they expire from search_cache, only used when a search fails.
+# Entries are the same objects as in search_cache, so they cost little extra memory.
+stale_search_cache = TTLCache(
+    ttl_seconds=SEARCH_STALE_TTL_SECONDS,
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    max_bytes=SEARCH_CACHE_MAX_BYTES
+)
+
+# Why an answer was made without fresh search results
+DEGRADED_STALE_SEARCH = "stale_search"
+DEGRADED_NO_SEARCH = "no_search"
+
+# Stands in for the search results when there are none to give the LLM
+NO_SEARCH_RESULTS = (
+    "Web search is unavailable right now. Answer from general knowledge "
+    "and say that the answer could not be checked against current sources."
+)
 
 class ResearchAgent:
-    def __init__(self):
+    def __init__(self, llm=None, search_tool=None):
+        # Providers can be passed in; otherwise RESEARCH_PROVIDER picks real or fake ones
+        self.llm = llm if llm is not None else self._create_llm()
+        self.search_tool = search_tool if search_tool is not None else self._create_search_tool()
+        
+        # Create prompt template
+        # LangChain is imported on first use so importing this module (and the app) stays fast
+        from langchain_core.prompts import ChatPromptTemplate
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are a helpful research assistant. Your job is to:
+1. Analyze the search results provided
+2. Provide personalized responses based on user preferences
+3. Always cite your sources
+
+IMPORTANT RESPONSE LENGTH RULES:
+- If user prefers "short": Provide ONLY 2-3 bullet points maximum, keep each point very brief
+- If user prefers "medium": Provide 3-5 bullet points with some details
+- If user prefers "long": Provide comprehensive information with sources
+
+Always be accurate and helpful."""),
+            ("human", "Query: {query}\nSearch Results: {search_results}\nUser Preferences: {preferences}")
+        ])
+    
+    @staticmethod
+    def preload():
+        """Import LangChain and the provider modules without creating any clients.
+        
+        Called in a pre-forking server's master so workers share the imported code.
+        """
+        import langchain_core.prompts
+        if RESEARCH_PROVIDER == "fake":
+            import fake_providers
+            return
+        import langchain_openai
+        import langchain_community.tools
+    
+    @staticmethod
+    def _create_llm():
+        """Build the chat model: any LangChain chat model with invoke/ainvoke/astream works"""
+        if RESEARCH_PROVIDER == "fake":
+            from fake_providers import FakeChatModel
+            return FakeChatModel()
+        
         # API Keys - Load from environment variables
         openai_key = os.getenv("OPENAI_API_KEY")
-        tavily_key = os.getenv("TAVILY_API_KEY")
-        
-        # Initialize LLM
         try:
-            self.llm = ChatOpenAI(
+            from langchain_openai import ChatOpenAI
+            llm = ChatOpenAI(
                 model="gpt-3.5-turbo",
                 temperature=0.1,
-                api_key=openai_key
+                api_key=openai_key,
+                # Deadlines and retries are handled by llm_guard
+                timeout=LLM_TIMEOUT_SECONDS,
+                max_retries=0
             )
             print("OpenAI LLM initialized successfully!")
+            return llm
         except Exception as e:
             print(f"Error initializing OpenAI: {e}")
-            self.llm = None
+            return None
+    
+    @staticmethod
+    def _create_search_tool():
+        """Build the search tool: anything with invoke/ainvoke({"query": ...}) returning a list of
+        {"title", "content", "url"} dicts"""
+        if RESEARCH_PROVIDER == "fake":
+            from fake_providers import FakeSearchTool
+            return FakeSearchTool()
         
-        # Initialize search tool
+        tavily_key = os.getenv("TAVILY_API_KEY")
         try:
-            self.search_tool = TavilySearchResults(
+            from langchain_community.tools import TavilySearchResults
+            search_tool = TavilySearchResults(
                 tavily_api_key=tavily_key,
                 max_results=5
             )
             print("Tavily search tool initialized successfully!")
+            return search_tool
         except Exception as e:
             print(f"Error initializing Tavily: {e}")
-            self.search_tool = None
-        
-        # Create prompt template
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a helpful research assistant. Your job is to:
-1. Analyze the search results provided
-2. Provide personalized responses based on user preferences
-3. Always cite your sources
-
-IMPORTANT RESPONSE LENGTH RULES:
-- If user prefers "short": Provide ONLY 2-3 bullet points maximum, keep each point very brief
-- If user prefers "medium": Provide 3-5 bullet points with some details
-- If user prefers "long": Provide comprehensive information with sources
-
-Always be accurate and helpful."""),
-            ("human", "Query: {query}\nSearch Results: {search_results}\nUser Preferences: {preferences}")
-        ])
+            return None
     
     def research_query(self, query, user_preferences=None):
         """Process a research query with user preferences"""
+        return self.result_text(self.research(query, user_preferences))
+    
+    async def aresearch_query(self, query, user_preferences=None):
+        """Process a research query without blocking the event loop"""
+        return self.result_text(await self.aresearch(query, user_preferences))
+    
+    def research(self, query, user_preferences=None):
+        """Answer a query and say how the answer was made.
+        
+        Returns a dict (see make_result). If search fails the answer uses older
+        cached results or none, and "degraded" says which. If the LLM fails,
+        "response" is None and "error" explains why.
+        """
+        not_ready = self._check_ready()
+        if not_ready:
+            return self.make_result(error=not_ready)
+        
+        search_results = None
         try:
-            if not self.search_tool:
-                return "Search functionality not available. Please configure Tavily API key."
-            
-            if not self.llm:
-                return "AI processing not available. Please configure OpenAI API key."
-            
-            # Get user preferences for response formatting
-            preferred_topics = []
-            if user_preferences and isinstance(user_preferences, dict):
-                preferred_topics = user_preferences.get("preferred_topics", [])
-            
             # Search for information
-            search_results = self.search_tool.invoke({"query": query})
-            
-            # Format search results
-            formatted_results = ""
-            if isinstance(search_results, list):
-                for i, result in enumerate(search_results[:3], 1):
-                    formatted_results += f"{i}. {result.get('title', 'No title')}\n"
-                    formatted_results += f"   {result.get('content', 'No content')}\n"
-                    formatted_results += f"   URL: {result.get('url', 'No URL')}\n\n"
-            else:
-                formatted_results = str(search_results)
+            with span("search"):
+                search_results, degraded = self._search_or_fallback(query)
             
-            # Process user preferences
-            preferences_text = "standard response"
-            if user_preferences:
-                if isinstance(user_preferences, dict):
-                    summary_length = user_preferences.get("summary_length", "medium")
-                    preferred_topics = user_preferences.get("preferred_topics", [])
-                    
-                    if summary_length == "short":
-                        preferences_text = "CRITICAL: Provide ONLY 2-3 bullet points maximum. Keep each point very brief and concise. No long explanations."
-                    elif summary_length == "long":
-                        preferences_text = "Provide a detailed response with comprehensive information and sources"
-                    else:  # medium
-                        preferences_text = "Provide 3-5 bullet points with some details"
-                    
-                    if preferred_topics:
-                        preferences_text += f". Focus on topics: {', '.join(preferred_topics)}"
-                else:
-                    preferences_text = str(user_preferences)
+            # Generate response (prompt and LLM run separately so each is timed)
+            with span("prompt"):
+                prompt_value = self.prompt.invoke(self._build_prompt_input(query, search_results, user_preferences))
+            with span("llm"):
+                response = llm_guard.call(self.llm.invoke, prompt_value)
+            record_token_usage(response)
             
-            # Create the prompt
-            chain = self.prompt | self.llm
+            return self.make_result(response.content, self.extract_sources(search_results), degraded)
+        
+        except Exception as e:
+            return self._failed(e, search_results)
+    
+    async def aresearch(self, query, user_preferences=None):
+        """Async version of research"""
+        not_ready = self._check_ready()
+        if not_ready:
+            return self.make_result(error=not_ready)
+        
+        search_results = None
+        try:
+            with span("search"):
+                search_results, degraded = await self._asearch_or_fallback(query)
             
-            # Generate response
-            response = chain.invoke({
-                "query": query,
-                "search_results": formatted_results,
-                "preferences": preferences_text
-            })
+            with span("prompt"):
+                prompt_value = self.prompt.invoke(self._build_prompt_input(query, search_results, user_preferences))
+            with span("llm"):
+                response = await llm_guard.acall(self.llm.ainvoke, prompt_value)
+            record_token_usage(response)
             
-            return response.content
+            return self.make_result(response.content, self.extract_sources(search_results), degraded)
+        
+        except Exception as e:
+            return self._failed(e, search_results)
+    
+    @staticmethod
+    def make_result(response=None, sources=None, degraded=None, error=None, retry_after=None):
+        """Build the dict returned by research and aresearch"""
+        return {
+            "response": response,
+            "sources": sources or [],
+            "degraded": degraded,
+            "error": error,
+            "retry_after": retry_after
+        }
+    
+    def _failed(self, error, search_results):
+        """Result for a query the LLM could not answer, keeping the sources that were found"""
+        retry_after = error.retry_after if isinstance(error, CircuitOpenError) else None
+        return self.make_result(
+            sources=self.extract_sources(search_results),
+            error=f"Error processing query: {str(error)}",
+            retry_after=retry_after
+        )
+    
+    @staticmethod
+    def result_text(result):
+        """The answer of a research result, or its error message"""
+        return result["response"] if result["error"] is None else result["error"]
+    
+    async def astream_research(self, query, user_preferences=None):
+        """Stream a research answer as ("sources", list) followed by ("token", text) events.
+        
+        A ("degraded", reason) event comes first if search failed, and an
+        ("error", message) event ends the stream if the LLM failed.
+        """
+        not_ready = self._check_ready()
+        if not_ready:
+            yield ("error", not_ready)
+            return
+        
+        with span("search"):
+            search_results, degraded = await self._asearch_or_fallback(query)
+        if degraded:
+            yield ("degraded", degraded)
+        yield ("sources", self.extract_sources(search_results))
+        
+        with span("prompt"):
+            prompt_value = self.prompt.invoke(self._build_prompt_input(query, search_results, user_preferences))
+        try:
+            llm_guard.begin_call()
+        except CircuitOpenError as e:
+            yield ("error", f"Error processing query: {str(e)}")
+            return
+        # Only time spent waiting on the LLM counts, not time the client takes to read tokens
+        llm_seconds = 0.0
+        chunks = aiter(self.llm.astream(prompt_value))
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    # Each chunk has to arrive within the LLM deadline; tokens already sent cannot be retried
+                    chunk = await llm_guard.anext(chunks)
+                except StopAsyncIteration:
+                    break
+                finally:
+                    llm_seconds += time.perf_counter() - start
+                record_token_usage(chunk)
+                if chunk.content:
+                    yield ("token", chunk.content)
+            llm_guard.end_call()
+        except Exception as e:
+            research_stage_errors.inc(stage="llm")
+            llm_guard.end_call(e)
+            yield ("error", f"Error processing query: {str(e)}")
+        except BaseException:
+            # The client went away
+            llm_guard.abandon_call()
+            raise
+        finally:
+            research_stage_duration.observe(llm_seconds, stage="llm")
+            # Closes the upstream request if the client went away mid-answer
+            await chunks.aclose()
+    
+    def _search(self, query):
+        """Run a web search, answering repeated queries from the search cache"""
+        cached = search_cache.get(query)
+        if cached is not None:
+            return cached
+        results = search_guard.call(self._invoke_search, query)
+        search_cache.set(query, results)
+        stale_search_cache.set(query, results)
+        return results
+    
+    async def _asearch(self, query):
+        """Async version of _search"""
+        cached = search_cache.get(query)
+        if cached is not None:
+            return cached
+        results = await search_guard.acall(self._ainvoke_search, query)
+        search_cache.set(query, results)
+        stale_search_cache.set(query, results)
+        return results
+    
+    def _invoke_search(self, query):
+        """Call the search tool once, treating anything but a result list as a failure"""
+        return self._check_search_results(self.search_tool.invoke({"query": query}))
+    
+    async def _ainvoke_search(self, query):
+        """Async version of _invoke_search"""
+        return self._check_search_results(await self.search_tool.ainvoke({"query": query}))
+    
+    @staticmethod
+    def _check_search_results(results):
+        """Raise if the search tool returned an error instead of results"""
+        if not isinstance(results, list):
+            # Tavily reports its own errors as a string result
+            raise RuntimeError(f"Search failed: {results}")
+        return results
+    
+    def _search_or_fallback(self, query):
+        """Search, or fall back to expired results or none; returns (results, degraded reason)"""
+        try:
+            return self._search(query), None
+        except Exception:
+            return self._search_fallback(query)
+    
+    async def _asearch_or_fallback(self, query):
+        """Async version of _search_or_fallback"""
+        try:
+            return await self._asearch(query), None
+        except Exception:
+            return self._search_fallback(query)
+    
+    @staticmethod
+    def _search_fallback(query):
+        """Results to answer with after a failed search"""
+        research_stage_errors.inc(stage="search")
+        stale = stale_search_cache.get(query)
+        degraded = DEGRADED_STALE_SEARCH if stale is not None else DEGRADED_NO_SEARCH
+        research_degraded.inc(reason=degraded)
+        return (stale if stale is not None else NO_SEARCH_RESULTS), degraded
+    
+    def _check_ready(self):
+        """Return an explanation if the search tool or LLM is missing"""
+        if not self.search_tool:
+            return "Search functionality not available. Please configure Tavily API key."
+        
+        if not self.llm:
+            return "AI processing not available. Please configure OpenAI API key."
         
+        return None
+    
+    def _build_prompt_input(self, query, search_results, user_preferences):
+        """Build the prompt variables"""
+        return {
+            "query": query,
+            "search_results": self.format_search_results(search_results),
+            "preferences": self.build_preferences_text(user_preferences)
+        }
+    
+    @staticmethod
+    def format_search_results(search_results):
+        """Format search results for the prompt"""
+        formatted_results = ""
+        if isinstance(search_results, list):
+            for i, result in enumerate(search_results[:3], 1):
+                formatted_results += f"{i}. {result.get('title', 'No title')}\n"
+                formatted_results += f"   {result.get('content', 'No content')}\n"
+                formatted_results += f"   URL: {result.get('url', 'No URL')}\n\n"
+        else:
+            formatted_results = str(search_results)
+        return formatted_results
+    
+    @staticmethod
+    def extract_sources(search_results):
+        """Get the title and URL of the search results used in the prompt"""
+        if not isinstance(search_results, list):
+            return []
+        return [
+            {"title": result.get("title", "No title"), "url": result.get("url", "No URL")}
+            for result in search_results[:3]
+        ]
+    
+    @staticmethod
+    def build_preferences_text(user_preferences):
+        """Turn user preferences into the instruction text used in the prompt"""
+        preferences_text = "standard response"
+        if user_preferences:
+            if isinstance(user_preferences, dict):
+                summary_length = user_preferences.get("summary_length", "medium")
+                preferred_topics = user_preferences.get("preferred_topics", [])
+                
+                if summary_length == "short":
+                    preferences_text = "CRITICAL: Provide ONLY 2-3 bullet points maximum. Keep each point very brief and concise. No long explanations."
+                elif summary_length == "long":
+                    preferences_text = "Provide a detailed response with comprehensive information and sources"
+                else:  # medium
+                    preferences_text = "Provide 3-5 bullet points with some details"
+                
+                if preferred_topics:
+                    preferences_text += f". Focus on topics: {', '.join(preferred_topics)}"
+            else:
+                preferences_text = str(user_preferences)
+        return preferences_text
+    
+    def is_healthy(self):
+        """Check that the LLM and search tool are ready to use"""
+        return self.llm is not None and self.search_tool is not None
+    
+    async def aclose(self):
+        """Release the HTTP clients held by the LLM"""
+        try:
+            sync_client = getattr(self.llm, "root_client", None)
+            if sync_client is not None:
+                sync_client.close()
+            async_client = getattr(self.llm, "root_async_client", None)
+            if async_client is not None:
+                await async_client.close()
         except Exception as e:
-            return f"Error processing query: {str(e)}"
+            print(f"Error closing OpenAI clients: {e}")
+        self.llm = None
+        self.search_tool = None
     
     def simple_search(self, query, max_results=3):
         """Simple search without agent for basic queries"""
@@ -115,7 +410,7 @@ Always be accurate and helpful."""),
             if not self.search_tool:
                 return "Search functionality not available. Please configure Tavily API key."
             
-            results = self.search_tool.invoke({"query": query})
+            results = self._search(query)
             return results
         except Exception as e:
             return f"Search error: {str(e)}"
\ No newline at end of file
@@ -1,13 +1,13 @@
 from fastapi import HTTPException
-from research_service import ResearchService
+from research_service import ResearchService, RESEARCH_BATCH_MAX_QUERIES
 from user_model import User
 
 class ResearchController:
     
-    def __init__(self):
-        self.research_service = ResearchService()
+    def __init__(self, agent=None):
+        self.research_service = ResearchService(agent)
     
-    def process_query(self, user_id, query):
+    def process_query(self, user_id, query, user=None):
         """Process a research query for a user"""
         if not query or not query.strip():
             raise HTTPException(status_code=400, detail="Query cannot be empty")
@@ -15,7 +15,51 @@ class ResearchController:
         if not user_id:
             raise HTTPException(status_code=400, detail="User ID is required")
         
-        return self.research_service.process_research_query(user_id, query)
+        return self.research_service.process_research_query(user_id, query, user)
+    
+    async def aprocess_query(self, user_id, query, user=None):
+        """Process a research query for a user without blocking the event loop"""
+        if not query or not query.strip():
+            raise HTTPException(status_code=400, detail="Query cannot be empty")
+        
+        if not user_id:
+            raise HTTPException(status_code=400, detail="User ID is required")
+        
+        return await self.research_service.aprocess_research_query(user_id, query, user)
+    
+    async def abatch_process_queries(self, user_id, queries, user=None):
+        """Process a batch of research queries for a user"""
+        self.validate_batch(user_id, queries)
+        return await self.research_service.abatch_research_queries(user_id, queries, user)
+    
+    @staticmethod
+    def validate_batch(user_id, queries):
+        """Check a batch before any research work starts and return how many queries will run"""
+        if not user_id:
+            raise HTTPException(status_code=400, detail="User ID is required")
+        
+        if not queries:
+            raise HTTPException(status_code=400, detail="At least one query is required")
+        
+        if len(queries) > RESEARCH_BATCH_MAX_QUERIES:
+            raise HTTPException(status_code=400, detail=f"A batch can have at most {RESEARCH_BATCH_MAX_QUERIES} queries")
+        
+        # Empty queries come back as per-item errors without running
+        return sum(1 for query in queries if query and query.strip())
+    
+    @staticmethod
+    def validate_query(user_id, query):
+        """Check the query and user before any research work starts"""
+        if not query or not query.strip():
+            raise HTTPException(status_code=400, detail="Query cannot be empty")
+        
+        if not user_id:
+            raise HTTPException(status_code=400, detail="User ID is required")
+    
+    def astream_query(self, user_id, query, is_disconnected=None, user=None):
+        """Stream a research answer for a user as Server-Sent Events"""
+        self.validate_query(user_id, query)
+        return self.research_service.astream_research_query(user_id, query, is_disconnected, user)
     
     def get_research_history(self, user_id):
         """Get research history for a user"""
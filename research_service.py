@@ -1,45 +1,316 @@
+import asyncio
+import json
+import math
+import os
+from contextlib import aclosing
 from research_agent import ResearchAgent
 from user_model import User
+from user_repository import user_repository
 from conversation_model import Conversation
+from answer_cache_model import AnswerCache
+from conversation_writer import conversation_writer
+from single_flight import research_flight
+from admission import admission
+from metrics import span, research_answers
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+# Batch research settings - can be overridden with environment variables
+RESEARCH_BATCH_MAX_QUERIES = int(os.getenv("RESEARCH_BATCH_MAX_QUERIES", "50"))
+RESEARCH_BATCH_CONCURRENCY = int(os.getenv("RESEARCH_BATCH_CONCURRENCY", "8"))
+# Seconds between checks that a streaming client is still connected
+RESEARCH_STREAM_DISCONNECT_CHECK = float(os.getenv("RESEARCH_STREAM_DISCONNECT_CHECK", "0.5"))
 
 class ResearchService:
-    def __init__(self):
-        self.agent = ResearchAgent()
+    def __init__(self, agent=None):
+        # Reuse a pooled agent when one is given, otherwise build a private one
+        self.agent = agent or ResearchAgent()
     
-    def process_research_query(self, user_id, query):
+    def process_research_query(self, user_id, query, user=None):
         """Process a research query for a specific user"""
         try:
-            # Get user preferences
-            user = User.get_by_id(user_id)
+            # Get user preferences (callers that already hold the user pass it in)
+            if user is None:
+                user = User.get_by_id(user_id)
             if not user:
                 raise HTTPException(status_code=404, detail="User not found")
             
             # Get user preferences
             user_preferences = user.get_preferences_dict()
             
-            # Process the query with the research agent
-            response = self.agent.research_query(query, user_preferences)
+            # Reuse a cached answer for the same query and preferences
+            preferences_text = ResearchAgent.build_preferences_text(user_preferences)
+            with span("answer_cache"):
+                entry = AnswerCache.get(query, preferences_text)
+            cached = entry is not None
+            
+            if cached:
+                result = ResearchAgent.make_result(entry["response"], entry["sources"])
+            else:
+                # Process the query with the research agent, sharing the work
+                # with any identical query that is already running
+                result = research_flight.do(
+                    AnswerCache.make_key(query, preferences_text),
+                    self._generate_answer, query, user_preferences, preferences_text
+                )
+            self._record_answer(result, cached)
+            if result["error"] is not None:
+                raise self._unavailable(result)
             
             # Save the conversation to database
             conversation = Conversation(
                 user_id=user_id,
                 query=query,
-                response=response
+                response=result["response"]
             )
-            conversation.save()
+            with span("db_save"):
+                conversation_writer.save(conversation)
             
             return {
                 "user_id": user_id,
                 "query": query,
-                "response": response,
+                "response": result["response"],
                 "conversation_id": conversation.id,
+                "user_preferences": user_preferences,
+                "cached": cached,
+                "degraded": result["degraded"]
+            }
+        
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Research service error: {str(e)}")
+    
+    async def aprocess_research_query(self, user_id, query, user=None):
+        """Process a research query without blocking the event loop"""
+        try:
+            # Database work runs off the event loop, the agent awaits its HTTP calls
+            if user is None:
+                user = await user_repository.get_by_id(user_id)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            
+            user_preferences = user.get_preferences_dict()
+            
+            preferences_text = ResearchAgent.build_preferences_text(user_preferences)
+            with span("answer_cache"):
+                entry = await run_in_threadpool(AnswerCache.get, query, preferences_text)
+            cached = entry is not None
+            
+            if cached:
+                result = ResearchAgent.make_result(entry["response"], entry["sources"])
+            else:
+                result = await research_flight.ado(
+                    AnswerCache.make_key(query, preferences_text),
+                    self._agenerate_answer, query, user_preferences, preferences_text
+                )
+            self._record_answer(result, cached)
+            # A failed answer is not saved as a conversation
+            if result["error"] is not None:
+                raise self._unavailable(result)
+            
+            conversation = Conversation(
+                user_id=user_id,
+                query=query,
+                response=result["response"]
+            )
+            with span("db_save"):
+                await conversation_writer.asave(conversation)
+            
+            return {
+                "user_id": user_id,
+                "query": query,
+                "response": result["response"],
+                "conversation_id": conversation.id,
+                "user_preferences": user_preferences,
+                "cached": cached,
+                "degraded": result["degraded"]
+            }
+        
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Research service error: {str(e)}")
+    
+    async def abatch_research_queries(self, user_id, queries, user=None, concurrency=RESEARCH_BATCH_CONCURRENCY):
+        """Answer many queries concurrently and save all conversations in one transaction"""
+        try:
+            if user is None:
+                user = await user_repository.get_by_id(user_id)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            
+            user_preferences = user.get_preferences_dict()
+            preferences_text = ResearchAgent.build_preferences_text(user_preferences)
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+            
+            async def answer(index, query):
+                if not query or not query.strip():
+                    return {"index": index, "query": query, "error": "Query cannot be empty"}
+                async with semaphore:
+                    try:
+                        # Batch queries wait for slots fairly with everyone else's requests
+                        async with admission.slot(user_id):
+                            with span("answer_cache"):
+                                entry = await run_in_threadpool(AnswerCache.get, query, preferences_text)
+                            cached = entry is not None
+                            if cached:
+                                result = ResearchAgent.make_result(entry["response"], entry["sources"])
+                            else:
+                                result = await research_flight.ado(
+                                    AnswerCache.make_key(query, preferences_text),
+                                    self._agenerate_answer, query, user_preferences, preferences_text
+                                )
+                    except HTTPException as e:
+                        return {"index": index, "query": query, "error": e.detail}
+                    except Exception as e:
+                        return {"index": index, "query": query, "error": str(e)}
+                self._record_answer(result, cached)
+                if result["error"] is not None:
+                    return {"index": index, "query": query, "error": result["error"]}
+                return {
+                    "index": index, "query": query, "response": result["response"],
+                    "cached": cached, "degraded": result["degraded"]
+                }
+            
+            results = await asyncio.gather(*[answer(i, q) for i, q in enumerate(queries)])
+            
+            # Save every successful answer with a single executemany (or buffer them)
+            succeeded = [result for result in results if "error" not in result]
+            conversations = [
+                Conversation(user_id=user_id, query=result["query"], response=result["response"])
+                for result in succeeded
+            ]
+            with span("db_save"):
+                await conversation_writer.asave_many(conversations)
+            for result, conversation in zip(succeeded, conversations):
+                result["conversation_id"] = conversation.id
+            
+            return {
+                "user_id": user_id,
+                "total": len(results),
+                "succeeded": len(succeeded),
+                "failed": len(results) - len(succeeded),
+                "results": results,
                 "user_preferences": user_preferences
             }
         
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Research service error: {str(e)}")
     
+    async def astream_research_query(self, user_id, query, is_disconnected=None, user=None):
+        """Stream a research answer as Server-Sent Events and save it when complete"""
+        try:
+            if user is None:
+                user = await user_repository.get_by_id(user_id)
+            if not user:
+                yield self.sse_event("error", {"detail": "User not found"})
+                return
+            
+            user_preferences = user.get_preferences_dict()
+            preferences_text = ResearchAgent.build_preferences_text(user_preferences)
+            with span("answer_cache"):
+                entry = await run_in_threadpool(AnswerCache.get, query, preferences_text)
+            cached = entry is not None
+            
+            degraded = None
+            if cached:
+                response = entry["response"]
+                yield self.sse_event("sources", entry["sources"])
+                yield self.sse_event("token", {"text": response})
+            else:
+                tokens = []
+                sources = []
+                loop = asyncio.get_running_loop()
+                next_check = loop.time()
+                # aclosing makes sure the upstream LLM request is closed if we stop early
+                async with aclosing(self.agent.astream_research(query, user_preferences)) as events:
+                    async for kind, data in events:
+                        # Asking the server about the connection is not free, so not on every token
+                        if is_disconnected and loop.time() >= next_check:
+                            next_check = loop.time() + RESEARCH_STREAM_DISCONNECT_CHECK
+                            if await is_disconnected():
+                                print(f"Client disconnected, dropping research stream for user {user_id}")
+                                return
+                        if kind == "error":
+                            # Nothing is saved; tokens already sent are to be discarded by the client
+                            self._record_answer(ResearchAgent.make_result(error=data), cached)
+                            yield self.sse_event("error", {"detail": data})
+                            return
+                        if kind == "degraded":
+                            degraded = data
+                            yield self.sse_event("degraded", {"reason": data})
+                        elif kind == "token":
+                            tokens.append(data)
+                            yield self.sse_event("token", {"text": data})
+                        else:
+                            if kind == "sources":
+                                sources = data
+                            yield self.sse_event(kind, data)
+                response = "".join(tokens)
+                # Answers made without fresh search results are not reused
+                if not degraded:
+                    await run_in_threadpool(AnswerCache.put, query, preferences_text, response, None, sources)
+            self._record_answer(ResearchAgent.make_result(response, degraded=degraded), cached)
+            
+            conversation = Conversation(
+                user_id=user_id,
+                query=query,
+                response=response
+            )
+            with span("db_save"):
+                await conversation_writer.asave(conversation)
+            
+            yield self.sse_event("done", {
+                "conversation_id": conversation.id,
+                "cached": cached,
+                "degraded": degraded
+            })
+        
+        except Exception as e:
+            yield self.sse_event("error", {"detail": f"Research service error: {str(e)}"})
+    
+    @staticmethod
+    def _record_answer(result, cached):
+        """Count where an answer came from: the answer cache, the agent, or an error"""
+        if cached:
+            research_answers.inc(source="answer_cache")
+        elif result["error"] is not None:
+            research_answers.inc(source="error")
+        else:
+            research_answers.inc(source="agent")
+    
+    @staticmethod
+    def _unavailable(result):
+        """503 for a query the providers could not answer, with Retry-After while a circuit is open"""
+        headers = None
+        if result["retry_after"] is not None:
+            headers = {"Retry-After": str(max(1, math.ceil(result["retry_after"])))}
+        return HTTPException(status_code=503, detail=result["error"], headers=headers)
+    
+    @staticmethod
+    def sse_event(event, data):
+        """Format one Server-Sent Event"""
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    def _generate_answer(self, query, user_preferences, preferences_text):
+        """Ask the agent for an answer and cache it unless it failed or is degraded"""
+        result = self.agent.research(query, user_preferences)
+        if result["error"] is None and not result["degraded"]:
+            AnswerCache.put(query, preferences_text, result["response"], sources=result["sources"])
+        return result
+    
+    async def _agenerate_answer(self, query, user_preferences, preferences_text):
+        """Async version of _generate_answer"""
+        result = await self.agent.aresearch(query, user_preferences)
+        if result["error"] is None and not result["degraded"]:
+            await run_in_threadpool(
+                AnswerCache.put, query, preferences_text, result["response"], None, result["sources"]
+            )
+        return result
+    
     def get_user_research_history(self, user_id):
         """Get research history for a user"""
         try:
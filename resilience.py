@@ -0,0 +1,297 @@
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Provider call settings - can be overridden with environment variables
+SEARCH_TIMEOUT_SECONDS = float(os.getenv("SEARCH_TIMEOUT_SECONDS", "8"))
+SEARCH_RETRIES = int(os.getenv("SEARCH_RETRIES", "2"))
+# Seconds before a slow search is raced by a second identical request, 0 turns it off
+SEARCH_HEDGE_DELAY = float(os.getenv("SEARCH_HEDGE_DELAY", "0"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "45"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "1"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.25"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+# Threads that run blocking provider calls so the caller can stop waiting at the deadline
+PROVIDER_CALL_THREADS = int(os.getenv("PROVIDER_CALL_THREADS", "32"))
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+class ProviderTimeout(Exception):
+    """A provider did not answer before the deadline"""
+
+class CircuitOpenError(Exception):
+    """A provider is skipped because its circuit breaker is open"""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} is unavailable, retry in {max(1, math.ceil(retry_after))}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Seconds to wait before retry number attempt + 1 (exponential, full jitter)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class CircuitBreaker:
+    """Fails fast while a provider keeps failing.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    are refused for reset_seconds. Then one trial call is let through
+    (half open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = CIRCUIT_CLOSED
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go to the provider now"""
+        with self._lock:
+            if self.state == CIRCUIT_OPEN:
+                remaining = self._opened_at + self.reset_seconds - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = CIRCUIT_HALF_OPEN
+                self._trial_running = False
+            if self.state == CIRCUIT_HALF_OPEN:
+                if self._trial_running:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 1)
+                self._trial_running = True
+
+    def record_success(self):
+        """A call succeeded: close the circuit"""
+        with self._lock:
+            self._consecutive_failures = 0
+            self._trial_running = False
+            if self.state != CIRCUIT_CLOSED:
+                self.state = CIRCUIT_CLOSED
+                print(f"Circuit for {self.name} closed")
+
+    def record_failure(self):
+        """A call failed: open the circuit after too many failures in a row"""
+        with self._lock:
+            self._consecutive_failures += 1
+            self._trial_running = False
+            if self.state == CIRCUIT_HALF_OPEN or (
+                self.state == CIRCUIT_CLOSED and self._consecutive_failures >= self.failure_threshold
+            ):
+                self.state = CIRCUIT_OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                print(f"Circuit for {self.name} opened after {self._consecutive_failures} failures")
+
+    def record_abandoned(self):
+        """A call was cancelled before it finished: let another trial call through"""
+        with self._lock:
+            self._trial_running = False
+
+    def retry_after(self):
+        """Seconds until the provider will be tried again, 0 if the circuit is closed"""
+        with self._lock:
+            if self.state != CIRCUIT_OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def stats(self):
+        """Get circuit breaker statistics"""
+        retry_after = self.retry_after()
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._consecutive_failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "retry_after": round(retry_after, 1)
+            }
+
+class ProviderGuard:
+    """Deadline, jittered retries, optional hedging and a circuit breaker around one provider.
+
+    Every attempt has its own deadline. A failed attempt is retried after a
+    random backoff unless the circuit opened meanwhile. With hedge_delay set,
+    an async attempt that has not answered after hedge_delay seconds is raced
+    by a second identical request and the first answer wins.
+    """
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, name, timeout, retries=0, hedge_delay=0.0, breaker=None):
+        self.name = name
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.hedge_delay = hedge_delay if 0 < hedge_delay < timeout else 0.0
+        self.breaker = breaker or CircuitBreaker(name)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _count(self, counter, amount=1):
+        """Add to one of the call counters"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _record(self, error):
+        """Feed an attempt's outcome to the counters and the breaker"""
+        if error is None:
+            self._count("successes")
+            self.breaker.record_success()
+            return
+        self._count("failures")
+        if isinstance(error, ProviderTimeout):
+            self._count("timeouts")
+        self.breaker.record_failure()
+
+    def _timed_out(self):
+        """Error for an attempt that ran past the deadline"""
+        return ProviderTimeout(f"{self.name} did not answer within {self.timeout:g}s")
+
+    @classmethod
+    def _get_executor(cls):
+        """Thread pool for blocking calls, created on first use"""
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(PROVIDER_CALL_THREADS, thread_name_prefix="provider-call")
+            return cls._executor
+
+    def call(self, fn, *args):
+        """Call a blocking fn(*args) with a deadline, retries and the breaker"""
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            self._count("calls")
+            # The call runs on a pool thread so we can stop waiting for it at the deadline
+            future = self._get_executor().submit(fn, *args)
+            try:
+                result = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                error = self._timed_out()
+            except Exception as e:
+                error = e
+            else:
+                self._record(None)
+                return result
+            self._record(error)
+            if attempt == self.retries:
+                raise error
+            self._count("retried")
+            time.sleep(backoff_delay(attempt))
+
+    async def acall(self, fn, *args):
+        """Await fn(*args) with a deadline, retries, hedging and the breaker"""
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            self._count("calls")
+            try:
+                result = await self._attempt(fn, *args)
+            except asyncio.CancelledError:
+                self.breaker.record_abandoned()
+                raise
+            except Exception as e:
+                self._record(e)
+                if attempt == self.retries:
+                    raise
+                self._count("retried")
+                await asyncio.sleep(backoff_delay(attempt))
+            else:
+                self._record(None)
+                return result
+
+    async def _attempt(self, fn, *args):
+        """One attempt, hedged if configured"""
+        if not self.hedge_delay:
+            try:
+                return await asyncio.wait_for(fn(*args), self.timeout)
+            except asyncio.TimeoutError:
+                raise self._timed_out()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        pending = {asyncio.ensure_future(fn(*args))}
+        hedge = None
+        error = None
+        try:
+            while pending:
+                wait = deadline - loop.time()
+                if hedge is None:
+                    wait = min(wait, self.hedge_delay)
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+                if done:
+                    continue
+                if hedge is not None or loop.time() >= deadline:
+                    raise self._timed_out()
+                # The first request is slow, race a second one against it
+                hedge = asyncio.ensure_future(fn(*args))
+                pending.add(hedge)
+                self._count("hedged")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def begin_call(self):
+        """Start a call made outside call/acall (e.g. a stream), raising CircuitOpenError if open"""
+        self.breaker.before_call()
+        self._count("calls")
+
+    def end_call(self, error=None):
+        """Record how a call started with begin_call ended: None for success, or the error"""
+        self._record(error)
+
+    def abandon_call(self):
+        """A call started with begin_call was given up by its caller, which says nothing about the provider"""
+        self.breaker.record_abandoned()
+
+    async def anext(self, iterator):
+        """Next item of an async iterator, failing with ProviderTimeout at the deadline"""
+        try:
+            return await asyncio.wait_for(anext(iterator), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._timed_out()
+
+    def stats(self):
+        """Get call counters and the breaker state"""
+        with self._lock:
+            counters = {
+                "timeout_seconds": self.timeout,
+                "calls": self.calls,
+                "successes": self.successes,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "retried": self.retried,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins
+            }
+        return dict(counters, circuit=self.breaker.stats())
+
+# Shared by every agent in the process, so one breaker sees every call to a provider
+search_guard = ProviderGuard("search", SEARCH_TIMEOUT_SECONDS, SEARCH_RETRIES, SEARCH_HEDGE_DELAY)
+llm_guard = ProviderGuard("llm", LLM_TIMEOUT_SECONDS, LLM_RETRIES)
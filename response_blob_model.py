@@ -0,0 +1,87 @@
+import time
+from database import db_connection
+from compression import hash_text, compress_text
+
+class ResponseBlob:
+    """Compressed response bodies stored once per distinct text, keyed on their content hash"""
+
+    @staticmethod
+    def store_many(cursor, texts):
+        """Store texts that are not stored yet and return their hashes in the same order.
+
+        Takes the write lock before looking up existing blobs (unless the caller
+        is already in a transaction), so delete_orphans cannot remove a blob
+        between the lookup and the caller's insert of the rows pointing at it.
+        """
+        if not cursor.connection.in_transaction:
+            # sqlite3 does not open a transaction for a SELECT on its own
+            cursor.execute("BEGIN IMMEDIATE")
+        hashes = [hash_text(text) for text in texts]
+        unique = dict(zip(hashes, texts))
+        placeholders = ", ".join("?" * len(unique))
+        cursor.execute(f"SELECT hash FROM response_blobs WHERE hash IN ({placeholders})", list(unique))
+        for row in cursor.fetchall():
+            del unique[row['hash']]
+
+        # Only new texts are compressed, duplicates just point at the existing blob
+        now = time.time()
+        rows = []
+        for content_hash, text in unique.items():
+            codec, data = compress_text(text)
+            rows.append((content_hash, codec, data, len(text.encode("utf-8")), len(data), now))
+        cursor.executemany(
+            """INSERT OR IGNORE INTO response_blobs (hash, codec, data, size, stored_size, created_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+        return hashes
+
+    @staticmethod
+    def store(cursor, text):
+        """Store one text and return its hash"""
+        return ResponseBlob.store_many(cursor, [text])[0]
+
+    @staticmethod
+    def delete_orphans(cursor, hashes):
+        """Delete the given blobs if no conversation points at them any more"""
+        removed = 0
+        for content_hash in set(hashes):
+            cursor.execute(
+                """DELETE FROM response_blobs WHERE hash = ?
+                   AND NOT EXISTS (SELECT 1 FROM conversations WHERE response_hash = ?)""",
+                (content_hash, content_hash)
+            )
+            removed += cursor.rowcount
+        return removed
+
+    @staticmethod
+    def space_report():
+        """Compare the bytes conversations would take uncompressed with what is actually stored"""
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT COUNT(*) AS conversations, COALESCE(SUM(b.size), 0) AS logical_bytes
+                   FROM conversations c JOIN response_blobs b ON b.hash = c.response_hash"""
+            )
+            referenced = cursor.fetchone()
+            cursor.execute(
+                """SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS unique_bytes,
+                          COALESCE(SUM(stored_size), 0) AS stored_bytes
+                   FROM response_blobs"""
+            )
+            stored = cursor.fetchone()
+            cursor.execute("SELECT codec, COUNT(*) AS blobs FROM response_blobs GROUP BY codec")
+            codecs = {row['codec']: row['blobs'] for row in cursor.fetchall()}
+
+        logical_bytes = referenced['logical_bytes']
+        stored_bytes = stored['stored_bytes']
+        return {
+            "conversations": referenced['conversations'],
+            "blobs": stored['blobs'],
+            "codecs": codecs,
+            "logical_bytes": logical_bytes,
+            "unique_bytes": stored['unique_bytes'],
+            "stored_bytes": stored_bytes,
+            "saved_bytes": logical_bytes - stored_bytes,
+            "ratio": round(logical_bytes / stored_bytes, 2) if stored_bytes else 0.0
+        }
@@ -0,0 +1,215 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+# Cross-process cache settings - can be overridden with environment variables
+SHARED_CACHE_FILE = os.getenv("SHARED_CACHE_FILE")  # Unset keeps every cache local to its process
+SHARED_CACHE_LOCAL_TTL_SECONDS = float(os.getenv("SHARED_CACHE_LOCAL_TTL_SECONDS", "5"))
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "100000"))
+SHARED_CACHE_BUSY_TIMEOUT_MS = int(os.getenv("SHARED_CACHE_BUSY_TIMEOUT_MS", "200"))
+
+class SharedCache:
+    """Cache in a SQLite file that every worker process on the host reads and writes.
+
+    Values are pickled, so the file must only be writable by this service.
+    """
+
+    def __init__(self, path, namespace, ttl_seconds=300, max_entries=SHARED_CACHE_MAX_ENTRIES,
+                 key_func=None, purge_every=500):
+        self.path = path
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.key_func = key_func
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sets_since_purge = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _connection(self):
+        """This thread's connection, reopened after a fork"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=SHARED_CACHE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")  # Losing recent cache writes in a crash is harmless
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache(expires_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _key(self, key):
+        """Apply the key normalization function; keys are stored as text"""
+        return str(self.key_func(key) if self.key_func else key)
+
+    def _failed(self, action, error):
+        """Count a SQLite error; the cache is skipped rather than failing the request"""
+        with self._lock:
+            self.errors += 1
+        print(f"Shared cache {action} failed: {error}")
+
+    def get_with_expiry(self, key):
+        """Get (value, expires_at) of a live entry, or None"""
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, self._key(key), time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._failed("read", e)
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(row[0]), row[1]
+
+    def get(self, key, default=None):
+        """Get a cached value, or default if missing or expired"""
+        entry = self.get_with_expiry(key)
+        return entry[0] if entry is not None else default
+
+    def set(self, key, value, ttl_seconds=None):
+        """Store a value for ttl_seconds (defaults to the cache TTL)"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, self._key(key), data, time.time() + ttl)
+            )
+        except (sqlite3.Error, pickle.PicklingError, TypeError) as e:
+            self._failed("write", e)
+            return
+        with self._lock:
+            self._sets_since_purge += 1
+            purge = self._sets_since_purge >= self.purge_every
+            if purge:
+                self._sets_since_purge = 0
+        if purge:
+            self.purge()
+
+    def delete(self, key):
+        """Remove a value for every process"""
+        try:
+            self._connection().execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, self._key(key))
+            )
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+
+    def clear(self):
+        """Remove every entry in this namespace and reset the counters"""
+        try:
+            self._connection().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            self._failed("clear", e)
+        with self._lock:
+            self.hits = self.misses = self.errors = 0
+
+    def purge(self):
+        """Delete expired entries and the ones closest to expiry over max_entries"""
+        try:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            conn.execute("""
+                DELETE FROM cache WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache WHERE namespace = ?
+                    ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.namespace, self.namespace, self.max_entries))
+        except sqlite3.Error as e:
+            self._failed("purge", e)
+
+    def stats(self):
+        """Get hit/miss counters of this process and the entries shared by all of them"""
+        try:
+            entries = self._connection().execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            entries = 0
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "errors": self.errors, "entries": entries}
+
+class TieredCache:
+    """In-process TTLCache in front of a SharedCache, with the TTLCache interface.
+
+    Local copies live at most local_ttl_seconds, so a change or delete made by
+    another worker is seen within that time.
+    """
+
+    def __init__(self, local, shared, local_ttl_seconds=SHARED_CACHE_LOCAL_TTL_SECONDS):
+        self.local = local
+        self.shared = shared
+        self.local_ttl_seconds = local_ttl_seconds
+        self.ttl_seconds = local.ttl_seconds
+
+    def get(self, key, default=None):
+        """Get a value from this process, then from the shared file"""
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        entry = self.shared.get_with_expiry(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        ttl = min(self.local_ttl_seconds, expires_at - time.time())
+        if ttl > 0:
+            self.local.set(key, value, ttl_seconds=ttl)
+        return value
+
+    def set(self, key, value, ttl_seconds=None):
+        """Store a value in both tiers"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self.local.set(key, value, ttl_seconds=min(ttl, self.local_ttl_seconds))
+        self.shared.set(key, value, ttl_seconds=ttl)
+
+    def delete(self, key):
+        """Remove a value here and for every other process"""
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def clear(self):
+        """Remove every entry in both tiers"""
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        """Local statistics, with shared-tier hits counted as hits"""
+        local = self.local.stats()
+        shared = self.shared.stats()
+        hits = local["hits"] + shared["hits"]
+        lookups = local["hits"] + local["misses"]
+        return dict(
+            local,
+            hits=hits,
+            misses=shared["misses"],
+            hit_rate=round(hits / lookups, 4) if lookups else 0.0,
+            shared_hits=shared["hits"],
+            shared_errors=shared["errors"],
+            shared_entries=shared["entries"]
+        )
+
+def with_shared_tier(local, namespace):
+    """Put a shared tier behind a local cache when SHARED_CACHE_FILE is set"""
+    if not SHARED_CACHE_FILE:
+        return local
+    shared = SharedCache(SHARED_CACHE_FILE, namespace, ttl_seconds=local.ttl_seconds, key_func=local.key_func)
+    return TieredCache(local, shared)
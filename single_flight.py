@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+class _Call:
+    """A call in flight that other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn once for all threads that ask for the same key at the same time"""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key, coro_fn, *args, **kwargs):
+        """Await coro_fn once for all coroutines that ask for the same key at the same time"""
+        with self._lock:
+            self.calls += 1
+            task = self._tasks.get(key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                # Run as a separate task so one caller going away does not cancel the others
+                task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+                self._tasks[key] = task
+                self.executions += 1
+                task.add_done_callback(lambda finished, key=key: self._forget(key, finished))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        """Drop a finished task so the next call starts a fresh execution"""
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when nobody was left to await it
+            task.exception()
+
+    def stats(self):
+        """Get coalescing counters"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._tasks)
+            }
+
+# Shared by every research request in the process
+research_flight = SingleFlight()
@@ -0,0 +1,37 @@
+import argparse
+import json
+import database
+from response_blob_model import ResponseBlob
+
+def _format_bytes(count):
+    """Human readable byte count"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(count) < 1024 or unit == "GiB":
+            return f"{count:.1f} {unit}" if unit != "B" else f"{count} B"
+        count /= 1024
+
+def main(argv=None):
+    """Command line entry point: python storage_report.py [--database ai_assistant.db] [--json]"""
+    parser = argparse.ArgumentParser(description="Report how much space compressed response storage saves")
+    parser.add_argument("--database", default=database.DATABASE_FILE, help="SQLite database file")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    database.DATABASE_FILE = args.database
+    # Also moves responses of an older database into the blob table
+    database.init_database()
+    report = ResponseBlob.space_report()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Conversations:        {report['conversations']}")
+    print(f"Distinct responses:   {report['blobs']} {report['codecs']}")
+    print(f"Uncompressed size:    {_format_bytes(report['logical_bytes'])}")
+    print(f"After deduplication:  {_format_bytes(report['unique_bytes'])}")
+    print(f"Stored (compressed):  {_format_bytes(report['stored_bytes'])}")
+    print(f"Saved:                {_format_bytes(report['saved_bytes'])} ({report['ratio']}x smaller)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+from answer_cache_model import AnswerCache
+from cache import normalize_query
+
+def test_punctuation_that_changes_meaning_gives_different_keys():
+    keys = {AnswerCache.make_key(query, "standard response") for query in ("C++ tutorial", "C# tutorial", "C tutorial")}
+    assert len(keys) == 3
+
+def test_case_spacing_and_question_mark_are_ignored():
+    assert normalize_query("  What is   AI? ") == normalize_query("what is ai")
+    assert AnswerCache.make_key("What is AI?", "x") == AnswerCache.make_key("what is ai", "x")
+
+def test_preferences_are_part_of_the_key():
+    assert AnswerCache.make_key("what is ai", "short") != AnswerCache.make_key("what is ai", "long")
@@ -0,0 +1,46 @@
+import sqlite3
+from conversation_model import Conversation
+from conversation_writer import ConversationWriteBuffer
+
+def make_buffer(monkeypatch, insert):
+    monkeypatch.setattr(Conversation, "reserve_ids", staticmethod(lambda count: 1))
+    monkeypatch.setattr(Conversation, "insert_many_with_ids", staticmethod(insert))
+    buffer = ConversationWriteBuffer(enabled=True, flush_interval=0.01, flush_retries=3)
+    # No flusher thread, but keep save() from writing through on its own
+    buffer._thread = object()
+    return buffer
+
+def test_locked_database_never_drops_rows(monkeypatch):
+    written = []
+    locked = {"flushes": 10}
+    def insert(conversations):
+        if locked["flushes"]:
+            locked["flushes"] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        written.extend(conversations)
+
+    buffer = make_buffer(monkeypatch, insert)
+    for n in range(3):
+        buffer.save(Conversation(user_id=1, query=f"q{n}", response="r"))
+    for attempt in range(10):
+        assert buffer.flush() == 0
+    assert buffer.stats()["pending"] == 3
+    assert buffer.flush() == 3
+    assert [c.query for c in written] == ["q0", "q1", "q2"]
+    assert buffer.stats()["rows_dropped"] == 0
+
+def test_bad_row_is_dropped_after_retries(monkeypatch):
+    written = []
+    def insert(conversations):
+        if any(c.query == "bad" for c in conversations):
+            raise sqlite3.IntegrityError("bad row")
+        written.extend(conversations)
+
+    buffer = make_buffer(monkeypatch, insert)
+    for query in ("good", "bad"):
+        buffer.save(Conversation(user_id=1, query=query, response="r"))
+    for attempt in range(3):
+        buffer.flush()
+    assert [c.query for c in written] == ["good"]
+    stats = buffer.stats()
+    assert stats["pending"] == 0 and stats["rows_dropped"] == 1
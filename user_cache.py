@@ -0,0 +1,44 @@
+import copy
+import os
+import time
+from cache import TTLCache
+from shared_cache import with_shared_tier
+
+# Authenticated user cache settings - can be overridden with environment variables
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "4096"))
+
+# Decoded JWT -> user id, and user id -> User
+token_cache = TTLCache(ttl_seconds=USER_CACHE_TTL_SECONDS, max_entries=USER_CACHE_MAX_ENTRIES, key_func=None)
+# Users change, so with several workers they are shared and invalidated for all of them
+user_cache = with_shared_tier(
+    TTLCache(ttl_seconds=USER_CACHE_TTL_SECONDS, max_entries=USER_CACHE_MAX_ENTRIES, key_func=None), "user"
+)
+
+def get_cached_token(token):
+    """Get the user id of an already verified token, or None"""
+    return token_cache.get(token)
+
+def cache_token(token, user_id, expires_at=None):
+    """Remember a verified token, never past its own expiry"""
+    ttl = USER_CACHE_TTL_SECONDS
+    if expires_at is not None:
+        ttl = min(ttl, expires_at - time.time())
+    if ttl > 0:
+        token_cache.set(token, user_id, ttl_seconds=ttl)
+
+def get_cached_user(user_id):
+    """Get a copy of a cached User, or None"""
+    user = user_cache.get(int(user_id))
+    # Hand out copies so callers cannot change the cached object
+    return copy.copy(user) if user is not None else None
+
+def cache_user(user):
+    """Cache a User loaded from the database"""
+    if user is not None and user.id is not None:
+        user_cache.set(int(user.id), copy.copy(user))
+
+def invalidate_user(user_id):
+    """Forget a user after it was changed or deleted"""
+    if user_id is not None:
+        user_cache.delete(int(user_id))
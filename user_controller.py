@@ -1,6 +1,9 @@
 from fastapi import HTTPException
 from user_model import User
+from user_repository import user_repository
+from password_utils import verify_and_update, averify_and_update, aget_password_hash, PasswordHasherBusy
 from auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from user_cache import invalidate_user
 from datetime import timedelta
 
 class UserController:
@@ -9,18 +12,7 @@ class UserController:
     def register_user(email, password, full_name, summary_length="medium", preferred_topics=None):
         """Register a new user with structured preferences"""
         try:
-            if not email:
-                raise HTTPException(status_code=400, detail="Email is required")
-            
-            if not password:
-                raise HTTPException(status_code=400, detail="Password is required")
-            
-            if not full_name:
-                raise HTTPException(status_code=400, detail="Full name is required")
-            
-            # Validate summary_length
-            if summary_length not in ["short", "medium", "long"]:
-                raise HTTPException(status_code=400, detail="Summary length must be 'short', 'medium', or 'long'")
+            UserController._validate_registration(email, password, full_name, summary_length)
             
             # Check if user already exists
             existing_user = User.get_by_email(email)
@@ -43,6 +35,49 @@ class UserController:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
     
+    @staticmethod
+    async def aregister_user(email, password, full_name, summary_length="medium", preferred_topics=None):
+        """Register a new user, hashing the password in the hashing pool"""
+        try:
+            UserController._validate_registration(email, password, full_name, summary_length)
+            
+            existing_user = await user_repository.get_by_email(email)
+            if existing_user:
+                raise HTTPException(status_code=400, detail="User with this email already exists")
+            
+            try:
+                hashed_password = await aget_password_hash(password)
+            except PasswordHasherBusy as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+            
+            user = User(email=email, password=hashed_password, full_name=full_name)
+            user.set_preferences_dict({
+                "summary_length": summary_length,
+                "preferred_topics": preferred_topics or []
+            })
+            await user_repository.save(user, password_is_hashed=True)
+            return user.to_dict()
+        
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
+    
+    @staticmethod
+    def _validate_registration(email, password, full_name, summary_length):
+        """Check the registration fields"""
+        if not email:
+            raise HTTPException(status_code=400, detail="Email is required")
+        
+        if not password:
+            raise HTTPException(status_code=400, detail="Password is required")
+        
+        if not full_name:
+            raise HTTPException(status_code=400, detail="Full name is required")
+        
+        if summary_length not in ["short", "medium", "long"]:
+            raise HTTPException(status_code=400, detail="Summary length must be 'short', 'medium', or 'long'")
+    
     @staticmethod
     def login_user(email, password):
         """Login user"""
@@ -58,10 +93,44 @@ class UserController:
             raise HTTPException(status_code=401, detail="Invalid email or password")
         
         # Verify password
-        if not user.verify_password(password):
+        valid, new_hash = verify_and_update(password, user.password)
+        if not valid:
             raise HTTPException(status_code=401, detail="Invalid email or password")
         
-        # Create access token
+        # Rehash transparently when the hashing cost setting changed
+        if new_hash:
+            User.update_password_hash(user.id, new_hash)
+        
+        return UserController._login_response(user)
+    
+    @staticmethod
+    async def alogin_user(email, password):
+        """Login user, verifying the password in the hashing pool"""
+        if not email:
+            raise HTTPException(status_code=400, detail="Email is required")
+        
+        if not password:
+            raise HTTPException(status_code=400, detail="Password is required")
+        
+        user = await user_repository.get_by_email(email)
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid email or password")
+        
+        try:
+            valid, new_hash = await averify_and_update(password, user.password)
+        except PasswordHasherBusy as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        if not valid:
+            raise HTTPException(status_code=401, detail="Invalid email or password")
+        
+        if new_hash:
+            await user_repository.update_password_hash(user.id, new_hash)
+        
+        return UserController._login_response(user)
+    
+    @staticmethod
+    def _login_response(user):
+        """Create the access token response for a logged-in user"""
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
             data={"sub": str(user.id)}, expires_delta=access_token_expires
@@ -95,6 +164,30 @@ class UserController:
         # Save updated preferences
         user.set_preferences_dict(current_prefs)
         user.save()
+        # Research answers depend on preferences, so never serve the old ones
+        invalidate_user(user_id)
+        
+        return user.to_dict()
+    
+    @staticmethod
+    async def aupdate_user_preferences(user_id, summary_length=None, preferred_topics=None):
+        """Update user preferences without blocking the event loop"""
+        user = await user_repository.get_by_id(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        current_prefs = user.get_preferences_dict()
+        if summary_length is not None:
+            if summary_length not in ["short", "medium", "long"]:
+                raise HTTPException(status_code=400, detail="Summary length must be 'short', 'medium', or 'long'")
+            current_prefs["summary_length"] = summary_length
+        
+        if preferred_topics is not None:
+            current_prefs["preferred_topics"] = preferred_topics
+        
+        # Saving forgets the cached user, so research answers never use the old preferences
+        user.set_preferences_dict(current_prefs)
+        await user_repository.save(user)
         
         return user.to_dict()
     
@@ -1,7 +1,8 @@
 import sqlite3
 import json
-from database import get_db_connection
+from database import db_connection
 from password_utils import get_password_hash, verify_password
+from user_cache import invalidate_user
 
 class User:
     def __init__(self, id=None, email=None, password=None, full_name=None, preferences=None, created_at=None):
@@ -13,11 +14,18 @@ class User:
         self.created_at = created_at
     
     
-    def save(self):
-        """Save user to database"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
+    def save(self, password_is_hashed=False):
+        """Save user to database (pass password_is_hashed=True if the password was hashed already)"""
+        password_hash = None
+        if not self.id:
+            password_hash = self.password if password_is_hashed else get_password_hash(self.password)
+        with db_connection() as conn:
+            self.store(conn.cursor(), password_hash)
+        invalidate_user(self.id)
+        return self
+    
+    def store(self, cursor, password_hash=None):
+        """Insert or update the user with an open cursor; a new user needs its password hash"""
         if self.id:
             # Update existing user
             cursor.execute(
@@ -26,25 +34,20 @@ class User:
             )
         else:
             # Create new user
-            hashed_password = get_password_hash(self.password)
             cursor.execute(
                 "INSERT INTO users (email, password, full_name, preferences) VALUES (?, ?, ?, ?)",
-                (self.email, hashed_password, self.full_name, self.preferences)
+                (self.email, password_hash, self.full_name, self.preferences)
             )
             self.id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
         return self
     
     @staticmethod
     def get_all():
         """Get all users"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users")
-        rows = cursor.fetchall()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users")
+            rows = cursor.fetchall()
         
         users = []
         for row in rows:
@@ -61,11 +64,14 @@ class User:
     @staticmethod
     def get_by_id(user_id):
         """Get user by ID"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            return User.fetch_by_id(conn.cursor(), user_id)
+    
+    @staticmethod
+    def fetch_by_id(cursor, user_id):
+        """Get user by ID with an open cursor"""
         cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return User(
@@ -80,11 +86,14 @@ class User:
     @staticmethod
     def get_by_email(email):
         """Get user by email"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            return User.fetch_by_email(conn.cursor(), email)
+    
+    @staticmethod
+    def fetch_by_email(cursor, email):
+        """Get user by email with an open cursor, password hash included"""
         cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return User(
@@ -97,6 +106,20 @@ class User:
             )
         return None
     
+    @staticmethod
+    def update_password_hash(user_id, password_hash):
+        """Replace a user's stored password hash (used to rehash after a cost change)"""
+        with db_connection() as conn:
+            success = User.store_password_hash(conn.cursor(), user_id, password_hash)
+        invalidate_user(user_id)
+        return success
+    
+    @staticmethod
+    def store_password_hash(cursor, user_id, password_hash):
+        """Replace a user's stored password hash with an open cursor"""
+        cursor.execute("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id))
+        return cursor.rowcount > 0
+    
     def verify_password(self, password):
         """Verify password"""
         return verify_password(password, self.password)
@@ -104,14 +127,17 @@ class User:
     @staticmethod
     def delete_by_id(user_id):
         """Delete user by ID"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            success = User.remove_by_id(conn.cursor(), user_id)
+        invalidate_user(user_id)
         return success
     
+    @staticmethod
+    def remove_by_id(cursor, user_id):
+        """Delete user by ID with an open cursor"""
+        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        return cursor.rowcount > 0
+    
     def get_preferences_dict(self):
         """Get preferences as dictionary"""
         if self.preferences:
@@ -0,0 +1,45 @@
+from db_worker import db_worker
+from password_utils import aget_password_hash
+from user_cache import invalidate_user
+from user_model import User
+
+class UserRepository:
+    """Async user storage for request handlers, run on the database thread.
+    
+    Uses the same SQL as User, whose static methods stay the sync API for scripts.
+    """
+    
+    def __init__(self, worker=db_worker):
+        self.worker = worker
+    
+    async def get_by_id(self, user_id):
+        """Get user by ID"""
+        return await self.worker.run(User.fetch_by_id, user_id)
+    
+    async def get_by_email(self, email):
+        """Get user by email, password hash included"""
+        return await self.worker.run(User.fetch_by_email, email)
+    
+    async def save(self, user, password_is_hashed=False):
+        """Save a user; a new user's password is hashed in the hashing pool, not the database thread"""
+        password_hash = None
+        if not user.id:
+            password_hash = user.password if password_is_hashed else await aget_password_hash(user.password)
+        await self.worker.run(user.store, password_hash, write=True)
+        invalidate_user(user.id)
+        return user
+    
+    async def update_password_hash(self, user_id, password_hash):
+        """Replace a user's stored password hash"""
+        success = await self.worker.run(User.store_password_hash, user_id, password_hash, write=True)
+        invalidate_user(user_id)
+        return success
+    
+    async def delete_by_id(self, user_id):
+        """Delete user by ID"""
+        success = await self.worker.run(User.remove_by_id, user_id, write=True)
+        invalidate_user(user_id)
+        return success
+
+# Shared repository for the whole process
+user_repository = UserRepository()